@@ -1,233 +1,264 @@
-import firebase_admin
-import os, json
-from firebase_admin import credentials, firestore
-from flask import Flask, flash, redirect, render_template, request, session, jsonify
-from werkzeug.security import check_password_hash, generate_password_hash
-from helpers import apology, login_required
+import os, sys, json, hmac
+from flask import Flask, Response, flash, redirect, render_template, request, session, jsonify, stream_with_context, url_for
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import escape
+from helpers import apology, login_required, private_dir
+from catalog import FOOD, RECIPE, SNAPSHOT_FIELDS, CatalogSnapshot, FoodIndex, get_nutrient_matrix, rank_key
+from daylog import MIGRATED_FLAG, meal_entries, nutrient_totals, split_day, summarize_range
+from loader import get_loader, submit
+from recipe_cache import RecipeCache, cache_key
+from recipe_stream import RECIPE_SCHEMA, RecipeStreamParser, parse_recipe_response, sse
+from jobs import JobQueue, QueueFull
+from passwords import hash_password, needs_rehash, verify_password
+from storage import WRITE_METHODS, create_storage
+from trending import ALL, TrendingRecipes, board_for
+from http_cache import cache_policy
+import http_cache
+import metrics
 from datetime import datetime as dt
-import google.genai as genai
-
+import queue
+import threading
 import time
 
-# Simple in-memory cache
-food_cache = {}  # key: normalized food_name, value: (timestamp, data)
+from cache import TTLCache
+from shared_cache import TieredCache, create_backend
+
+# Bounded in-memory caches, backed by a cache shared with the other workers on this host
 CACHE_TTL = 300  # seconds (5 minutes)
+shared_backend = create_backend()
+food_cache = TieredCache(  # key: normalized food_name
+    "food", TTLCache(max_entries=4096, max_bytes=4 * 1024 * 1024, ttl=CACHE_TTL), shared_backend
+)
+search_cache = TieredCache(  # key: autocomplete query
+    "search", TTLCache(max_entries=4096, max_bytes=4 * 1024 * 1024, ttl=CACHE_TTL), shared_backend
+)
+user_cache = TieredCache(  # key: user_id
+    "user", TTLCache(max_entries=1024, max_bytes=2 * 1024 * 1024, ttl=CACHE_TTL), shared_backend
+)
 
 def get_cached_food(doc_id):
     """Return cached food data if fresh, else None."""
-    entry = food_cache.get(doc_id)
-    if entry:
-        ts, data = entry
-        if time.time() - ts < CACHE_TTL:
-            return data
-    return None
+    data = food_cache.get(doc_id)
+    metrics.record_cache("food", data is not None)
+    return data
 
 def set_cached_food(doc_id, data):
-    food_cache[doc_id] = (time.time(), data)
+    food_cache.set(doc_id, data)
+
+def get_cached_search(query):
+    results = search_cache.get(query)
+    metrics.record_cache("search", results is not None)
+    return results
+
+def set_cached_search(query, results):
+    search_cache.set(query, results)
+
+def get_cached_user(user_id):
+    data = user_cache.get(user_id)
+    metrics.record_cache("user", data is not None)
+    return data
+
+# Only what the cached pages read is cached; the shared tier must never hold password hashes
+CACHED_USER_FIELDS = ("username", "rec_cal", MIGRATED_FLAG)
+
+def set_cached_user(user_id, data):
+    user_cache.set(user_id, {field: data[field] for field in CACHED_USER_FIELDS if field in data})
+
+GEMINI_MODEL = "gemini-2.5-flash"
+GEMINI_TIMEOUT = int(os.environ.get("GEMINI_TIMEOUT", 45))  # seconds, per call
+_gemini_client = None
+_gemini_lock = threading.Lock()
+
+def get_gemini_client():
+    """Build the Gemini client on first use; importing google.genai is slow."""
+    global _gemini_client
+    if _gemini_client is None:
+        with _gemini_lock:
+            if _gemini_client is None:
+                import google.genai as genai
+                _gemini_client = genai.Client(
+                    api_key=os.getenv('GEMINI_API'),
+                    http_options=genai.types.HttpOptions(timeout=GEMINI_TIMEOUT * 1000)
+                )
+    return _gemini_client
+
+recipe_cache = RecipeCache()
 
-client = genai.Client(api_key=os.getenv('GEMINI_API'))
-cred = credentials.Certificate("serviceAccountKey.json")
+def get_cached_recipe(key):
+    """Return (raw_text, parsed) for a stored generation, else None."""
+    cached = recipe_cache.get(key)
+    metrics.record_cache("recipe", cached is not None)
+    return cached
 
-if not firebase_admin._apps:
-    firebase_admin.initialize_app(cred)
+# Gemini calls run here instead of on request threads
+recipe_jobs = JobQueue(
+    max_workers=int(os.environ.get("RECIPE_WORKERS", 4)),
+    max_pending=int(os.environ.get("RECIPE_QUEUE_DEPTH", 16)),
+    per_user=int(os.environ.get("RECIPE_JOBS_PER_USER", 2)),
+    timeout=GEMINI_TIMEOUT
+)
 
-db = firestore.client()
+def _default_max_streams():
+    # An open SSE stream holds its worker thread for the whole generation, so
+    # streaming is only on by default under gevent, where that costs a greenlet
+    monkey = sys.modules.get("gevent.monkey")
+    return 64 if monkey is not None and monkey.is_module_patched("socket") else 0
+
+# Recipe streams open at once in this worker; beyond it the page polls a job instead
+MAX_STREAMS = int(os.environ.get("RECIPE_MAX_STREAMS", _default_max_streams()))
+_open_streams = 0
+_streams_lock = threading.Lock()
+
+def open_stream_slot():
+    """Reserve one of MAX_STREAMS stream slots; False when none is free."""
+    global _open_streams
+    with _streams_lock:
+        if _open_streams >= MAX_STREAMS:
+            return False
+        _open_streams += 1
+        return True
+
+def close_stream_slot():
+    global _open_streams
+    with _streams_lock:
+        _open_streams -= 1
+
+def streams_available():
+    return _open_streams < MAX_STREAMS
+
+# Firestore by default, or the local SQLite engine with STORAGE_BACKEND=sqlite
+storage = metrics.Instrumented(
+    create_storage(), "storage_read", {name: "storage_write" for name in WRITE_METHODS}
+)
+
+food_index = FoodIndex(recipe_loader=storage.recipe_names)
+catalog_snapshot = CatalogSnapshot(recipe_loader=storage.recipe_summaries)
+# Build the nutrient matrix when the worker starts, on the read pool so
+# importing the app stays fast, instead of in the first query request
+submit(get_nutrient_matrix)
+trending = TrendingRecipes(loader=storage.recipe_stats)
 
 # Initialize Flask App
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'dev-secret-key')
 app.config["SESSION_PERMANENT"] = False
-def get_user_food_data():
-    """Get all food data for current user from Firestore - TODAY ONLY."""
+
+# Keep compiled templates on disk so a restarted worker skips Jinja compilation
+# (Jinja's own per-user 0700 directory unless JINJA_CACHE_DIR names one)
+JINJA_CACHE_DIR = os.environ.get("JINJA_CACHE_DIR")
+try:
+    bytecode_cache = FileSystemBytecodeCache(private_dir(JINJA_CACHE_DIR) if JINJA_CACHE_DIR else None)
+    app.jinja_options = {**app.jinja_options, "bytecode_cache": bytecode_cache}
+except (OSError, RuntimeError) as e:
+    print(f"Template bytecode cache disabled: {e}")
+
+def get_user_food_data(user_data=None):
+    """Get user data, today's food entries and totals from storage - TODAY ONLY.
+
+    Pass already-known user_data to skip reading the user document.
+    """
     try:
         user_id = session.get("user_id")
         if not user_id:
-            return {}, []
+            return {}, [], {}
         
-        # Get user data
-        user_ref = db.collection("users").document(user_id).get()
-        if not user_ref.exists:
-            return {}, []
+        # Read the user and today's meals concurrently
+        loader = get_loader()
+        today = dt.now().strftime("%Y-%m-%d")
+        day_key = ("day", user_id, today)
+        if user_data is None:
+            loader.prefetch(("user", user_id), storage.get_user, user_id)
+            loader.prefetch(day_key, storage.get_day, user_id, today)
+            user_data = loader.get(("user", user_id), storage.get_user, user_id)
+            if not user_data:
+                return {}, [], {}
+        else:
+            loader.prefetch(day_key, storage.get_day, user_id, today)
         
-        user_data = user_ref.to_dict()
+        if storage.prepare_user(user_id, user_data):
+            loader.forget(day_key)
+            user_cache.invalidate(user_id)
         
-        # Get all food entries for today
-        today = dt.now().strftime("%Y-%m-%d")
+        # Today's meals and running totals live in a single day document
         food_entries = []
+        totals = {"kcal": 0, "carb": 0, "protein": 0}
         
         try:
-            meals_query = db.collection("users").document(user_id).collection("meals").where(
-                "date", "==", today
-            ).stream()
-            
-            for meal_doc in meals_query:
-                meal_data = meal_doc.to_dict()
-                serving = float(meal_data.get("serving", 1))  # Convert to float
-                carb = float(meal_data.get("carb", 0))
-                protein = float(meal_data.get("protein", 0))
-                kcal = float(meal_data.get("kcal", 0))
-                
-                food_entries.append({
-                    "meal_id": meal_doc.id,
-                    "food_name": meal_data.get("food_name", ""),
-                    "serving": serving,
-                    "carbs": round(carb * serving, 2),
-                    "protein": round(protein * serving, 2),
-                    "kcal": round(kcal * serving, 2)
-                })
+            meals, totals = split_day(loader.get(day_key, storage.get_day, user_id, today))
+            food_entries = meal_entries(meals)
+            for entry in food_entries:
+                entry["date"] = today  # so edits submitted after midnight find the right day
         except Exception as e:
             print(f"Error fetching meals: {e}")
         
-        return user_data, food_entries
+        return user_data, food_entries, totals
     except Exception as e:
         print(f"Error in get_user_food_data: {e}")
-        return {}, []
-
-def calculate_totals(food_entries):
-    """Calculate total calories, carbs, and protein from food entries."""
-    total_carbs = sum(entry["carbs"] for entry in food_entries)
-    total_protein = sum(entry["protein"] for entry in food_entries)
-    total_calories = sum(entry["kcal"] for entry in food_entries)
-    
-    return round(total_calories, 2), round(total_carbs, 2), round(total_protein, 2)
-
-def parse_recipe_response(recipe_text):
-    """Parse Gemini recipe response into structured data."""
-    try:
-        recipe_data = {
-            "name": "",
-            "ingredients": [],
-            "steps": [],
-            "calories": 0,
-            "protein": 0,
-            "carbs": 0,
-            "raw_content": recipe_text
-        }
-        
-        # Extract recipe name - handle both newline and inline formats
-        name_start = recipe_text.find("**Recipe Name:**")
-        if name_start != -1:
-            name_start += len("**Recipe Name:**")
-            # Try to find next ** marker (new section)
-            name_end = recipe_text.find("**", name_start)
-            if name_end == -1:
-                # No more markers, look for newline
-                name_end = recipe_text.find("\n", name_start)
-            if name_end == -1:
-                # No newline either, take rest
-                name_end = len(recipe_text)
-            recipe_data["name"] = recipe_text[name_start:name_end].strip()
-        
-        # Extract ingredients
-        ingredients_start = recipe_text.find("**Ingredients:**")
-        steps_start = recipe_text.find("**Steps:**")
-        if ingredients_start != -1 and steps_start != -1:
-            ingredients_text = recipe_text[ingredients_start:steps_start]
-            # Remove the header and split by - or newline
-            ingredients_text = ingredients_text.replace("**Ingredients:**", "")
-            for item in ingredients_text.split("-"):
-                ingredient = item.strip()
-                if ingredient and ingredient.startswith("**") is False:
-                    recipe_data["ingredients"].append(ingredient)
-        
-        # Extract steps
-        nutrition_start = recipe_text.find("**Nutrition:**")
-        if steps_start != -1:
-            if nutrition_start != -1:
-                steps_text = recipe_text[steps_start:nutrition_start]
-            else:
-                steps_text = recipe_text[steps_start:]
-            
-            # Remove the header
-            steps_text = steps_text.replace("**Steps:**", "")
-            
-            # Split by numbers (1., 2., etc.)
-            import re
-            step_pattern = r'\d+\.\s+(.+?)(?=\d+\.|$)'
-            steps = re.findall(step_pattern, steps_text, re.DOTALL)
-            for step in steps:
-                step_text = step.strip()
-                if step_text:
-                    recipe_data["steps"].append(step_text)
-        
-        # Extract nutrition info
-        if nutrition_start != -1:
-            nutrition_text = recipe_text[nutrition_start:]
-            
-            # Extract calories
-            cal_match = nutrition_text.find("Calories:")
-            if cal_match != -1:
-                cal_start = cal_match + len("Calories:")
-                cal_end = nutrition_text.find(",", cal_start)
-                if cal_end == -1:
-                    cal_end = nutrition_text.find("\n", cal_start)
-                try:
-                    recipe_data["calories"] = float(nutrition_text[cal_start:cal_end].strip())
-                except ValueError:
-                    pass
-            
-            # Extract protein
-            protein_match = nutrition_text.find("Protein:")
-            if protein_match != -1:
-                protein_start = protein_match + len("Protein:")
-                protein_end = nutrition_text.find("g", protein_start)
-                if protein_end != -1:
-                    try:
-                        recipe_data["protein"] = float(nutrition_text[protein_start:protein_end].strip())
-                    except ValueError:
-                        pass
-            
-            # Extract carbs
-            carbs_match = nutrition_text.find("Carbs:")
-            if carbs_match != -1:
-                carbs_start = carbs_match + len("Carbs:")
-                carbs_end = nutrition_text.find("g", carbs_start)
-                if carbs_end != -1:
-                    try:
-                        recipe_data["carbs"] = float(nutrition_text[carbs_start:carbs_end].strip())
-                    except ValueError:
-                        pass
-        
-        return recipe_data
-    except Exception as e:
-        print(f"Error parsing recipe: {e}")
-        return None
+        return {}, [], {}
 
 def format_recipe_html(recipe_data):
-    """Format parsed recipe data into HTML."""
-    html = f"<h2 style='color: #2c3e50; margin-bottom: 1.5rem;'>{recipe_data.get('name', 'Recipe')}</h2>"
+    """Format parsed recipe data into HTML, escaping the model's text."""
+    html = f"<h2 style='color: #2c3e50; margin-bottom: 1.5rem;'>{escape(recipe_data.get('name', 'Recipe'))}</h2>"
     
     if recipe_data.get('ingredients'):
         html += "<h4 class='section-title' style='border-bottom: 2px solid #4CAF50; padding-bottom: 0.5rem;'>Ingredients</h4>"
         for ingredient in recipe_data['ingredients']:
-            html += f"<div class='ingredient-item'>🥗 {ingredient}</div>"
+            html += f"<div class='ingredient-item'>🥗 {escape(ingredient)}</div>"
     
     if recipe_data.get('steps'):
         html += "<h4 class='section-title' style='margin-top: 1.5rem; border-bottom: 2px solid #4CAF50; padding-bottom: 0.5rem;'>Steps</h4>"
         for i, step in enumerate(recipe_data['steps'], 1):
-            html += f"<div class='step-item'><strong>Step {i}:</strong> {step}</div>"
+            html += f"<div class='step-item'><strong>Step {i}:</strong> {escape(step)}</div>"
     
     return html
 
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+@app.before_request
+def before_request():
+    """Start per-request timing"""
+    metrics.start_request(request.url_rule.rule if request.url_rule else "unmatched")
+
 @app.after_request
 def after_request(response):
-    """Ensure responses aren't cached"""
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
-    return response
+    """Apply the route's cache policy and report where the request's time went"""
+    stats = metrics.current()
+    if stats is not None:
+        response.headers["Server-Timing"] = stats.server_timing()
+        metrics.registry.observe_request(
+            stats.route, request.method, response.status_code, time.perf_counter() - stats.started
+        )
+    return http_cache.apply(response, app.view_functions.get(request.endpoint), app.static_folder)
+
+@app.url_defaults
+def fingerprint_static(endpoint, values):
+    """Add a content hash to static URLs so browsers can cache them for good"""
+    if endpoint == "static" and "filename" in values and "v" not in values:
+        try:
+            values["v"] = http_cache.fingerprint(os.path.join(app.static_folder, values["filename"]))
+        except OSError:
+            pass
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus scrape endpoint, served only with METRICS_TOKEN set and sent as a bearer token"""
+    if not METRICS_TOKEN:
+        return Response("Not Found\n", status=404, mimetype="text/plain")
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/", methods=["GET"])
 @login_required
 def index():
     """Display Calories and main dashboard"""
     try:
-        user_data, food_entries = get_user_food_data()
+        user_data, food_entries, totals = get_user_food_data()
         
         if not user_data:
             return apology("User not found")
         
-        total_calories, total_carbs, total_protein = calculate_totals(food_entries)
+        total_calories, total_carbs, total_protein = totals["kcal"], totals["carb"], totals["protein"]
         recommended_calories = user_data.get("rec_cal", 2500)
         
         return render_template(
@@ -252,7 +283,8 @@ def index():
 @app.route('/modmeal', methods=['POST'])
 @login_required
 def modmeal():
-    """Modify meal servings or delete meals."""
+    """Modify meal servings or delete meals in one atomic commit."""
+    wants_json = request.accept_mimetypes.best == "application/json"
     try:
         user_id = session.get("user_id")
         items_data = request.form.getlist('items')
@@ -267,28 +299,49 @@ def modmeal():
             flash("Invalid data format")
             return redirect('/')
         
+        # Validate every item before writing anything
+        today = dt.now().strftime("%Y-%m-%d")
+        edits = {}
         for item in modified_items:
-            meal_id = item.get('meal_id')
-            serving = item.get('serving')
-            delitem = item.get('delitem')
+            meal_id = item.get('meal_id') if isinstance(item, dict) else None
+            if not meal_id:
+                flash("Invalid data format")
+                return redirect('/')
+            
+            date = item.get('date') or today
+            try:
+                dt.strptime(date, "%Y-%m-%d")
+            except (ValueError, TypeError):
+                flash("Invalid date")
+                return redirect('/')
             
-            if delitem == 'true':
-                # Delete meal
-                db.collection("users").document(user_id).collection("meals").document(meal_id).delete()
+            if item.get('delitem') == 'true':
+                serving = None
             else:
-                # Update serving
                 try:
-                    serving = float(serving)
-                    db.collection("users").document(user_id).collection("meals").document(meal_id).update({
-                        "serving": serving
-                    })
+                    serving = float(item.get('serving'))
                 except (ValueError, TypeError):
+                    serving = 0
+                if serving <= 0:
                     flash("Invalid serving amount")
-                    continue
+                    return redirect('/')
+            edits.setdefault(date, []).append((meal_id, serving))
         
-        flash("Meals updated")
+        applied = storage.edit_meals(user_id, edits)
+        missing = sum(len(day_edits) for day_edits in edits.values()) - len(applied)
+        if wants_json:
+            return jsonify({"status": "success", "applied": applied, "missing": missing})
+        
+        deleted = sum(1 for edit in applied if edit["serving"] is None)
+        if missing:
+            flash(f"Meals updated ({len(applied) - deleted} changed, {deleted} deleted); "
+                  f"{missing} no longer in that day's log, please check them again")
+        else:
+            flash(f"Meals updated ({len(applied) - deleted} changed, {deleted} deleted)")
     except Exception as e:
         print(f"Error in modmeal: {e}")
+        if wants_json:
+            return jsonify({"error": "Error updating meals"}), 500
         flash("Error updating meals")
     
     return redirect('/')
@@ -306,16 +359,25 @@ def login():
             return apology("Username and password required")
         
         try:
-            user_ref = db.collection("users").document(username).get()
-            if user_ref.exists:
-                user_data = user_ref.to_dict()
-                if check_password_hash(user_data.get("password_hash", ""), password):
+            user_data = storage.get_user(username)
+            if user_data:
+                stored_hash = user_data.get("password_hash", "")
+                if verify_password(stored_hash, password):
                     session["user_id"] = username
+                    if needs_rehash(stored_hash):
+                        # Upgrade hashes made with older parameters while we have the password
+                        try:
+                            storage.update_user(username, {"password_hash": hash_password(password)})
+                            user_cache.invalidate(username)
+                        except Exception as e:
+                            print(f"Rehash error: {e}")
                     return redirect("/")
                 else:
                     return apology("Invalid credentials")
             else:
                 return apology("Invalid credentials")
+        except QueueFull as e:
+            return apology(str(e), 503)
         except Exception as e:
             print(f"Login error: {e}")
             return apology("Login error")
@@ -348,8 +410,7 @@ def register():
         
         # Check if user exists
         try:
-            user_ref = db.collection("users").document(username).get()
-            if user_ref.exists:
+            if storage.get_user(username):
                 return apology("Username already exists")
         except Exception as e:
             print(f"Check user error: {e}")
@@ -365,10 +426,10 @@ def register():
         else:
             reccal = 2200
         
-        # Create user in Firestore
+        # Create user
         try:
-            hashed_password = generate_password_hash(password)
-            db.collection("users").document(username).set({
+            hashed_password = hash_password(password)
+            storage.create_user(username, {
                 "username": username,
                 "password_hash": hashed_password,
                 "weight": weight,
@@ -377,9 +438,12 @@ def register():
                 "rec_cal": reccal,
                 "created_at": dt.now().isoformat()
             })
+            user_cache.invalidate(username)
             
             flash("Registration successful")
             return redirect("/login")
+        except QueueFull as e:
+            return apology(str(e), 503)
         except Exception as e:
             print(f"Registration error: {e}")
             return apology("Registration error")
@@ -395,9 +459,8 @@ def api_getUserDetails():
     
     if request.method == "GET":
         try:
-            user_ref = db.collection("users").document(user_id).get()
-            if user_ref.exists:
-                user_data = user_ref.to_dict()
+            user_data = storage.get_user(user_id)
+            if user_data:
                 return jsonify({
                     "username": user_data.get("username"),
                     "weight": user_data.get("weight"),
@@ -429,14 +492,15 @@ def api_getUserDetails():
             else:
                 new_reccal = 2200
             
-            # Update Firestore
-            db.collection("users").document(user_id).update({
+            # Update the stored profile
+            storage.update_user(user_id, {
                 "height": new_height,
                 "weight": new_weight,
                 "bmi": new_bmi,
                 "rec_cal": new_reccal,
                 "updated_at": dt.now().isoformat()
             })
+            user_cache.invalidate(user_id)
             
             return jsonify({"status": "success"})
         except ValueError:
@@ -445,6 +509,76 @@ def api_getUserDetails():
             print(f"Update user error: {e}")
             return jsonify({"error": "Update error"}), 500
 
+@app.route("/api/foods/query", methods=["GET"])
+@cache_policy("catalog")
+@login_required
+def api_foods_query():
+    """Filter and rank catalog foods by nutrient, e.g. ?max_kcal=300&min_protein=10&sort=protein/kcal"""
+    try:
+        filters = []
+        for key, value in request.args.items():
+            op, _, nutrient = key.partition("_")
+            if op in ("min", "max") and nutrient:
+                filters.append((nutrient, op, float(value)))
+
+        limit = max(1, min(int(request.args.get("limit", 20)), 200))
+        results = get_nutrient_matrix().query(
+            filters,
+            sort=request.args.get("sort") or None,
+            descending=request.args.get("order", "desc") != "asc",
+            limit=limit,
+            basis=request.args.get("basis", "serving"),
+        )
+        return jsonify(results)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Food query error: {e}")
+        return jsonify({"error": "Query error"}), 500
+
+@app.route("/api/catalog", methods=["GET"])
+@cache_policy("revalidate")
+@login_required
+def api_catalog():
+    """URL of the current catalog snapshot plus the recipes saved since it was built"""
+    try:
+        version, _ = catalog_snapshot.current()
+        return jsonify({
+            "version": version,
+            "url": url_for("api_catalog_snapshot", version=version),
+            "fields": SNAPSHOT_FIELDS,
+            "recipes": catalog_snapshot.delta()
+        })
+    except Exception as e:
+        print(f"Catalog snapshot error: {e}")
+        return jsonify({"error": "Catalog unavailable"}), 503
+
+@app.route("/api/catalog/<version>", methods=["GET"])
+@cache_policy("immutable")
+def api_catalog_snapshot(version):
+    """Every food and recipe with per-serving macros; the content never changes for a version"""
+    try:
+        current, body = catalog_snapshot.current()
+    except Exception as e:
+        print(f"Catalog snapshot error: {e}")
+        return jsonify({"error": "Catalog unavailable"}), 503
+    if version != current:
+        return redirect(url_for("api_catalog_snapshot", version=current))
+    return Response(body, mimetype="application/json")
+
+@app.route("/api/recipes/trending", methods=["GET"])
+@cache_policy("catalog")
+@login_required
+def api_trending_recipes():
+    """Popular recipes, e.g. ?meal_time=lunch&max_kcal=600&limit=5"""
+    try:
+        limit = max(1, min(int(request.args.get("limit", 5)), 50))
+        max_kcal = request.args.get("max_kcal")
+        max_kcal = float(max_kcal) if max_kcal else None
+    except ValueError:
+        return jsonify({"error": "limit and max_kcal must be numbers"}), 400
+    return jsonify(trending.top(request.args.get("meal_time"), limit=limit, max_kcal=max_kcal))
+
 @app.route("/history", methods=["GET", "POST"])
 @login_required
 def history():
@@ -463,26 +597,16 @@ def history():
             # Format date
             date_str = f"{date_obj['year']}-{date_obj['month']:02d}-{date_obj['day']:02d}"
             
-            # Query meals for date
+            # Read the meals logged on date
             meals = []
             try:
-                meals_query = db.collection("users").document(user_id).collection("meals").where(
-                    "date", "==", date_str
-                ).stream()
-                
-                for meal_doc in meals_query:
-                    meal_data = meal_doc.to_dict()
-                    serving = float(meal_data.get("serving", 1))
-                    carb = float(meal_data.get("carb", 0))
-                    protein = float(meal_data.get("protein", 0))
-                    kcal = float(meal_data.get("kcal", 0))
-                    
+                for entry in meal_entries(split_day(storage.get_day(user_id, date_str))[0]):
                     meals.append({
-                        "food_name": meal_data.get("food_name"),
-                        "serving": serving,
-                        "carb": round(carb * serving, 2),
-                        "protein": round(protein * serving, 2),
-                        "total_cal": round(kcal * serving, 2)
+                        "food_name": entry["food_name"],
+                        "serving": entry["serving"],
+                        "carb": entry["carbs"],
+                        "protein": entry["protein"],
+                        "total_cal": entry["kcal"]
                     })
             except Exception as e:
                 print(f"History query error: {e}")
@@ -495,8 +619,114 @@ def history():
             print(f"History error: {e}")
             return jsonify({"error": "History error"}), 500
 
+@app.route("/api/nutrients", methods=["GET"])
+@login_required
+def api_nutrients():
+    """Every catalog nutrient summed over a day's meals, e.g. ?date=2025-01-31 (default today)"""
+    try:
+        user_id = session.get("user_id")
+        date_str = request.args.get("date") or dt.now().strftime("%Y-%m-%d")
+        try:
+            dt.strptime(date_str, "%Y-%m-%d")
+        except ValueError:
+            return jsonify({"error": "date must be YYYY-MM-DD"}), 400
+        
+        meals, _ = split_day(storage.get_day(user_id, date_str))
+        return jsonify({"date": date_str, "meals": len(meals), "totals": nutrient_totals(meals)})
+    except Exception as e:
+        print(f"Nutrients error: {e}")
+        return jsonify({"error": "Nutrients error"}), 500
+
+MAX_HISTORY_DAYS = 366
+
+@app.route("/history/range", methods=["GET"])
+@login_required
+def history_range():
+    """Per-day totals with rolling averages and weekly/monthly rollups, e.g. ?start=2025-01-01&end=2025-01-31"""
+    try:
+        user_id = session.get("user_id")
+        try:
+            start = dt.strptime(request.args.get("start", ""), "%Y-%m-%d").date()
+            end = dt.strptime(request.args.get("end", ""), "%Y-%m-%d").date()
+            window = int(request.args.get("window", 7))
+        except ValueError:
+            return jsonify({"error": "start and end must be YYYY-MM-DD"}), 400
+        
+        if end < start or (end - start).days >= MAX_HISTORY_DAYS or not 1 <= window <= 90:
+            return jsonify({"error": "Invalid range"}), 400
+        
+        days = storage.iter_days(user_id, start.isoformat(), end.isoformat())
+        return jsonify(summarize_range(days, start.isoformat(), end.isoformat(), window))
+    except Exception as e:
+        print(f"History range error: {e}")
+        return jsonify({"error": "History error"}), 500
+
+
+def lookup_food(food_name):
+    """
+    Return per-serving macros for a food or recipe name, or None.
+
+    Foods in the in-process catalog are answered without any read and
+    include their food_code. Otherwise the stored catalog and recipes are
+    read concurrently. A catalog hit is returned without waiting for the
+    recipes read; otherwise the recipe, which is usually back by then, is
+    used.
+    """
+    matrix = get_nutrient_matrix()
+    food_code = matrix.find(food_name)
+    if food_code:
+        macros = matrix.macros(food_code)
+        return {
+            "food_code": food_code,
+            "calories": macros["kcal"],
+            "carbs": macros["carb"],
+            "protein": macros["protein"]
+        }
+
+    doc_id = food_name.lower().replace(" ", "_")
+    food_future = submit(storage.find_food, food_name)
+    recipe_future = submit(storage.get_recipe, doc_id)
+
+    try:
+        food_data = food_future.result()
+        if food_data:
+            return {
+                "calories": float(food_data.get("unit_serving_energy_kcal", 0)),
+                "carbs": float(food_data.get("unit_serving_carb_g", 0)),
+                "protein": float(food_data.get("unit_serving_protein_g", 0))
+            }
+    except Exception as e:
+        print(f"Error fetching from food_data: {e}")
+
+    try:
+        recipe_data = recipe_future.result()
+        if recipe_data:
+            return {
+                "calories": float(recipe_data.get("calories", 0)),
+                "carbs": float(recipe_data.get("carbs", 0)),
+                "protein": float(recipe_data.get("protein", 0))
+            }
+    except Exception as e:
+        print(f"Error fetching from recipes: {e}")
+
+    return None
+
+def search_storage(food_query, limit=5):
+    """Search foods and recipes in storage concurrently and merge the ranked hits."""
+    futures = [
+        (submit(storage.search_foods, food_query, limit), FOOD),
+        (submit(storage.search_recipes, food_query, limit), RECIPE)
+    ]
+    hits = {}
+    for future, kind in futures:
+        for name in future.result():
+            if name and name.lower() not in hits:
+                hits[name.lower()] = (name, kind)
+    ranked = sorted(hits.values(), key=lambda hit: rank_key(hit[0], hit[1], food_query))
+    return [name for name, _ in ranked[:limit]]
 
 @app.route("/addmeal", methods=["GET", "POST"])
+@cache_policy("catalog")
 @login_required
 def addmeal():
     """Add meal for user"""
@@ -520,46 +750,26 @@ def addmeal():
                 flash("Invalid serving")
                 return redirect('/')
             
-            food_data = None
-            
-            # Try to find in food_data collection
-            try:
-                food_docs = db.collection("food_data").where("food_name", "==", food_name).limit(1).get()
-                if food_docs:
-                    food_data = food_docs[0].to_dict()
-            except Exception as e:
-                print(f"Error fetching from food_data: {e}")
-            
-            # If not found, try recipes collection
-            if not food_data:
-                try:
-                    recipe_doc = db.collection("recipes").document(doc_id).get()
-                    if recipe_doc.exists:
-                        recipe = recipe_doc.to_dict()
-                        food_data = {
-                            "unit_serving_carb_g": recipe.get("carbs", 0),
-                            "unit_serving_protein_g": recipe.get("protein", 0),
-                            "unit_serving_energy_kcal": recipe.get("calories", 0)
-                        }
-                except Exception as e:
-                    print(f"Error fetching from recipes: {e}")
-            
-            # If still not found, flash error
+            # Look up food_data and recipes concurrently
+            food_data = lookup_food(food_name)
             if not food_data:
                 flash("Food not found")
                 return redirect('/')
 
             try:
                 today = dt.now().strftime("%Y-%m-%d")
-                db.collection("users").document(user_id).collection("meals").add({
+                meal = {
                     "food_name": food_name,
                     "serving": serving,
-                    "carb": food_data.get("unit_serving_carb_g", 0),
-                    "protein": food_data.get("unit_serving_protein_g", 0),
-                    "kcal": food_data.get("unit_serving_energy_kcal", 0),
                     "date": today,
                     "added_at": dt.now().isoformat()
-                })
+                }
+                if food_data.get("food_code"):
+                    # Catalog foods are stored by reference and resolved on read
+                    meal["food_code"] = food_data["food_code"]
+                else:
+                    meal.update(carb=food_data["carbs"], protein=food_data["protein"], kcal=food_data["calories"])
+                storage.add_meal(user_id, today, meal)
                 flash(f"Added {food_name}")
             except Exception as e:
                 print(f"Add meal error: {e}")
@@ -578,30 +788,12 @@ def addmeal():
 
                 # Try cache first
                 cached = get_cached_food(doc_id)
-                if cached:
+                if cached is not None:
                     return jsonify(cached)
 
-                # Lookup in food_data
-                food_docs = db.collection("food_data").where("food_name", "==", food_name).limit(1).get()
-                if food_docs:
-                    food_data = food_docs[0].to_dict()
-                    response = {
-                        "calories": float(food_data.get("unit_serving_energy_kcal", 0)),
-                        "carbs": float(food_data.get("unit_serving_carb_g", 0)),
-                        "protein": float(food_data.get("unit_serving_protein_g", 0))
-                    }
-                    set_cached_food(doc_id, response)
-                    return jsonify(response)
-
-                # Lookup in recipes
-                recipe_doc = db.collection("recipes").document(doc_id).get()
-                if recipe_doc.exists:
-                    recipe_data = recipe_doc.to_dict()
-                    response = {
-                        "calories": float(recipe_data.get("calories", 0)),
-                        "carbs": float(recipe_data.get("carbs", 0)),
-                        "protein": float(recipe_data.get("protein", 0))
-                    }
+                # Lookup in food_data and recipes concurrently
+                response = lookup_food(food_name)
+                if response:
                     set_cached_food(doc_id, response)
                     return jsonify(response)
 
@@ -612,46 +804,87 @@ def addmeal():
             if not food_query or len(food_query) < 1:
                 return jsonify([])
 
-            cached_search = get_cached_food(f"search_{food_query}")
-            if cached_search:
+            cached_search = get_cached_search(food_query)
+            if cached_search is not None:
                 return jsonify(cached_search)
 
-            foods = []
+            # Answer from the in-process index once it is built
+            foods = food_index.search(food_query)
+            if foods is not None:
+                set_cached_search(food_query, foods)
+                return jsonify(foods)
 
-            # Search food_data with array-contains on search_keywords
-            food_docs = db.collection("food_data") \
-                        .where("search_keywords", "array_contains", food_query) \
-                        .limit(5).stream()
-            for doc in food_docs:
-                foods.append(doc.to_dict().get("food_name"))
+            # Fall back to a storage search while the index builds
+            foods = search_storage(food_query)
 
-            # If less than 5 results, search recipes
-            if len(foods) < 5:
-                recipe_docs = db.collection("recipes") \
-                                .where("search_keywords", "array_contains", food_query) \
-                                .limit(5 - len(foods)).stream()
-                for doc in recipe_docs:
-                    foods.append(doc.to_dict().get("name"))
-
-            set_cached_food(f"search_{food_query}", foods)
+            set_cached_search(food_query, foods)
             return jsonify(foods)
         
         except Exception as e:
             print(f"AddMeal GET error: {e}")
             return jsonify({"error": "Error fetching food"}), 500
-# Simple in-memory cache
-# ---------------------------
-user_cache = {}
-CACHE_TTL = 300  # seconds (5 minutes)
 
-def get_cached_user(user_id):
-    entry = user_cache.get(user_id)
-    if entry and (time.time() - entry['time']) < CACHE_TTL:
-        return entry['data']
-    return None
+def build_recipe_prompt(remaining_calories, time_of_day, ingredients, structured=False):
+    """Recipe prompt; structured prompts leave the format to RECIPE_SCHEMA."""
+    request_text = f"""I have {remaining_calories} calories remaining for {time_of_day}. 
+
+Available ingredients: {ingredients}
+
+Suggest ONE recipe within this calorie limit.
+"""
+    if structured:
+        return request_text + """Give calories in kcal and protein and carbs in grams.
+The recipe name should be a general and intuitive one which other people should be able to guess. 
+It should be at most 3 words. Do not add any emoji of sorts.
+"""
+    return request_text + """
+Format:
+**Recipe Name:** [name]
+**Ingredients:**
+- [ingredient 1]
+- [ingredient 2]
+**Steps:**
+1. [step 1]
+2. [step 2]
+**Nutrition:** Calories: [X], Protein: [Xg], Carbs: [Xg]. 
+The recipe name should be a general and intuitive one which other people should be able to guess. 
+It should be at most 3 words. Do not add any emoji of sorts.
+"""
+
+def generate_recipe(remaining_calories, time_of_day, ingredients):
+    """Call Gemini for JSON output and parse the reply; returns (None, None) if the call fails."""
+    prompt = build_recipe_prompt(remaining_calories, time_of_day, ingredients, structured=True)
+    try:
+        with metrics.timed("gemini", "generate_content"):
+            response = get_gemini_client().models.generate_content(
+                model=GEMINI_MODEL,
+                contents=prompt,
+                config={"response_mime_type": "application/json", "response_json_schema": RECIPE_SCHEMA}
+            )
+        recipe_text = response.text
+    except Exception as api_error:
+        print(f"Gemini API error: {api_error}")
+        return None, None
+    return recipe_text, parse_recipe_response(recipe_text)
+
+def run_recipe_job(key, remaining_calories, time_of_day, ingredients):
+    """Generate, parse and cache a recipe; runs on the recipe job pool."""
+    recipe_text, recipe_data = generate_recipe(remaining_calories, time_of_day, ingredients)
+    if recipe_text is None:
+        raise RuntimeError("Could not generate recipe")
+    if not recipe_data:
+        raise RuntimeError("Could not parse recipe")
+    recipe_cache.set(key, recipe_text, recipe_data)
+    return {"recipe_data": recipe_data, "html": format_recipe_html(recipe_data)}
+
+def read_recipe_form(values):
+    """Return (remaining_calories, time_of_day, ingredients, fresh) from form or query values."""
+    remaining_calories = float(values.get('remaining_calories', '0'))
+    time_of_day = values.get('time_of_day', 'meal')
+    ingredients = values.get('ingredients', '')
+    fresh = values.get('fresh') == '1'
+    return remaining_calories, time_of_day, ingredients, fresh
 
-def set_cached_user(user_id, data):
-    user_cache[user_id] = {"data": data, "time": time.time()}
 @app.route("/make_food", methods=["GET", "POST"])
 @login_required
 def make_food():
@@ -660,20 +893,17 @@ def make_food():
     
     if request.method == "GET":
         try:
-            # Use cached user data if available
-            user_data = get_cached_user(user_id)
+            # Use cached user data if available; otherwise the user document
+            # is read together with today's meals
+            cached_user = get_cached_user(user_id)
+            user_data, food_entries, totals = get_user_food_data(cached_user)
             if not user_data:
-                user_ref = db.collection("users").document(user_id).get()
-                if not user_ref.exists:
-                    return redirect('/')
-                user_data = user_ref.to_dict()
+                return redirect('/')
+            if cached_user is None:
                 set_cached_user(user_id, user_data)
             
             recommended_calories = user_data.get("rec_cal", 2500)
-            
-            # Get today's consumed calories (avoid multiple reads)
-            user_data_obj, food_entries = get_user_food_data()
-            total_calories, _, _ = calculate_totals(food_entries)
+            total_calories = totals.get("kcal", 0)
             remaining_calories = recommended_calories - total_calories
             
             # Determine meal time
@@ -690,7 +920,8 @@ def make_food():
                 remaining_calories=max(0, remaining_calories),
                 time_of_day=time_of_day,
                 recommended_calories=recommended_calories,
-                calories_consumed=total_calories
+                calories_consumed=total_calories,
+                popular_recipes=trending.top(time_of_day, limit=5, max_kcal=max(0, remaining_calories))
             )
         except Exception as e:
             print(f"Make food GET error: {e}")
@@ -699,52 +930,52 @@ def make_food():
     
     elif request.method == "POST":
         try:
-            remaining_calories = request.form.get('remaining_calories', '0')
-            time_of_day = request.form.get('time_of_day', 'meal')
-            ingredients = request.form.get('ingredients', '')
-            
             # Validate input
             try:
-                remaining_calories = float(remaining_calories)
+                remaining_calories, time_of_day, ingredients, fresh = read_recipe_form(request.form)
             except ValueError:
                 flash("Invalid calorie input")
                 return redirect('/make_food')
             
-            # Create prompt
-            prompt = f"""I have {remaining_calories} calories remaining for {time_of_day}. 
-
-Available ingredients: {ingredients}
-
-Suggest ONE recipe within this calorie limit.
-
-Format:
-**Recipe Name:** [name]
-**Ingredients:**
-- [ingredient 1]
-- [ingredient 2]
-**Steps:**
-1. [step 1]
-2. [step 2]
-**Nutrition:** Calories: [X], Protein: [Xg], Carbs: [Xg]. 
-The recipe name should be a general and intuitive one which other people should be able to guess. 
-It should be at most 3 words. Do not add any emoji of sorts.
-"""
-            try:
-                response = client.models.generate_content(
-                    model="gemini-2.5-flash",
-                    contents=prompt
+            # Reuse a stored generation for the same inputs unless asked for something different
+            key = cache_key(ingredients, time_of_day, remaining_calories, GEMINI_MODEL)
+            cached = None if fresh else get_cached_recipe(key)
+            if cached:
+                recipe_text, recipe_data = cached
+            elif request.form.get('stream') == '1' and streams_available():
+                # Render the page right away and let it stream the recipe in
+                return render_template(
+                    'recipe.html',
+                    recipe_content="",
+                    recipe_data=None,
+                    remaining_calories=remaining_calories,
+                    time_of_day=time_of_day,
+                    ingredients=ingredients,
+                    stream_url=url_for(
+                        'make_food_stream',
+                        remaining_calories=remaining_calories,
+                        time_of_day=time_of_day,
+                        ingredients=ingredients
+                    )
+                )
+            else:
+                # Queue the generation on the bounded job pool and let the page poll for it
+                try:
+                    job = recipe_jobs.submit(
+                        user_id, run_recipe_job, key, remaining_calories, time_of_day, ingredients
+                    )
+                except QueueFull as e:
+                    flash(str(e))
+                    return redirect('/make_food')
+                return render_template(
+                    'recipe.html',
+                    recipe_content="",
+                    recipe_data=None,
+                    remaining_calories=remaining_calories,
+                    time_of_day=time_of_day,
+                    ingredients=ingredients,
+                    job_url=url_for('make_food_job_status', job_id=job.id)
                 )
-                recipe_text = response.text
-            except Exception as api_error:
-                print(f"Gemini API error: {api_error}")
-                flash("Could not generate recipe")
-                return redirect('/make_food')
-            
-            # Parse recipe response
-            recipe_data = parse_recipe_response(recipe_text)
-            if not recipe_data:
-                flash("Could not parse recipe")
-                return redirect('/make_food')
             
             # Format recipe for display
             formatted_recipe = format_recipe_html(recipe_data)
@@ -754,24 +985,153 @@ It should be at most 3 words. Do not add any emoji of sorts.
                 recipe_content=formatted_recipe,
                 recipe_data=recipe_data,
                 remaining_calories=remaining_calories,
-                time_of_day=time_of_day
+                time_of_day=time_of_day,
+                ingredients=ingredients
             )
         except Exception as e:
             print(f"Make food POST error: {e}")
             flash("Recipe error")
             return redirect('/make_food')
         
-shared_recipe_cache = {}
+@app.route("/make_food/stream", methods=["GET"])
+@login_required
+def make_food_stream():
+    """Stream a recipe suggestion as Server-Sent Events, one event per completed section."""
+    user_id = session.get("user_id")
+    try:
+        remaining_calories, time_of_day, ingredients, _ = read_recipe_form(request.args)
+    except ValueError:
+        return jsonify({"error": "Invalid calorie input"}), 400
+    if not open_stream_slot():
+        # No stream slot free: generate on the job pool and let the page poll instead
+        key = cache_key(ingredients, time_of_day, remaining_calories, GEMINI_MODEL)
+        try:
+            job = recipe_jobs.submit(user_id, run_recipe_job, key, remaining_calories, time_of_day, ingredients)
+        except QueueFull as e:
+            return Response(sse("error", {"error": str(e)}), mimetype="text/event-stream")
+        job_url = url_for('make_food_job_status', job_id=job.id)
+        return Response(sse("queued", {"job_url": job_url}), mimetype="text/event-stream")
+    prompt = build_recipe_prompt(remaining_calories, time_of_day, ingredients)
+    chunks = queue.Queue()
+
+    def produce():
+        # Runs on the recipe job pool; None marks the end of the stream
+        try:
+            with metrics.timed("gemini", "generate_content_stream"):
+                for chunk in get_gemini_client().models.generate_content_stream(model=GEMINI_MODEL, contents=prompt):
+                    chunks.put(chunk.text or "")
+        finally:
+            chunks.put(None)
+
+    try:
+        job = recipe_jobs.submit(user_id, produce)
+    except QueueFull as e:
+        close_stream_slot()
+        return Response(sse("error", {"error": str(e)}), mimetype="text/event-stream")
+
+    def events():
+        parser = RecipeStreamParser()
+        while True:
+            try:
+                text = chunks.get(timeout=1)
+            except queue.Empty:
+                if job.finished and chunks.empty():
+                    break
+                if time.time() > job.deadline + GEMINI_TIMEOUT:
+                    yield sse("error", {"error": "Recipe generation timed out"})
+                    return
+                continue
+            if text is None:
+                break
+            for section, value in parser.feed(text):
+                yield sse(section, value)
+
+        job.wait(5)
+        if job.status != "done":
+            yield sse("error", {"error": "Could not generate recipe"})
+            return
+        for section, value in parser.finish():
+            yield sse(section, value)
+
+        recipe_data = parse_recipe_response(parser.text)
+        if not recipe_data:
+            yield sse("error", {"error": "Could not parse recipe"})
+            return
+        key = cache_key(ingredients, time_of_day, remaining_calories, GEMINI_MODEL)
+        recipe_cache.set(key, parser.text, recipe_data)
+        yield sse("done", {"recipe_data": recipe_data, "html": format_recipe_html(recipe_data)})
+
+    response = Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"X-Accel-Buffering": "no"}
+    )
+    response.call_on_close(close_stream_slot)
+    return response
+
+# Polls answer at once by default; a ?wait long-poll holds a request thread,
+# so only a few may wait at a time and the rest get the current state back
+MAX_JOB_WAIT = 5  # seconds a long-poll request may block
+_job_waiters = threading.BoundedSemaphore(int(os.environ.get("RECIPE_MAX_JOB_WAITERS", 4)))
+
+@app.route("/make_food/jobs", methods=["POST"])
+@login_required
+def make_food_job():
+    """Queue a recipe generation and return its job id immediately."""
+    user_id = session.get("user_id")
+    try:
+        remaining_calories, time_of_day, ingredients, fresh = read_recipe_form(
+            request.get_json(silent=True) or request.form
+        )
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid calorie input"}), 400
+
+    key = cache_key(ingredients, time_of_day, remaining_calories, GEMINI_MODEL)
+    cached = None if fresh else get_cached_recipe(key)
+    if cached:
+        recipe_data = cached[1]
+        return jsonify({
+            "status": "done",
+            "result": {"recipe_data": recipe_data, "html": format_recipe_html(recipe_data)}
+        })
+
+    try:
+        job = recipe_jobs.submit(user_id, run_recipe_job, key, remaining_calories, time_of_day, ingredients)
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": "5"}
+    return jsonify(job.to_dict()), 202
+
+@app.route("/make_food/jobs/<job_id>", methods=["GET"])
+@login_required
+def make_food_job_status(job_id):
+    """Return a recipe job's state (202 while pending); ?wait=N long-polls for up to MAX_JOB_WAIT seconds."""
+    job = recipe_jobs.get(job_id)
+    if job is None or job.user_id != session.get("user_id"):
+        return jsonify({"error": "Job not found"}), 404
+    try:
+        wait = min(max(float(request.args.get("wait", 0)), 0), MAX_JOB_WAIT)
+    except ValueError:
+        wait = 0
+    if wait and not job.finished and _job_waiters.acquire(blocking=False):
+        try:
+            job.wait(wait)
+        finally:
+            _job_waiters.release()
+    if not job.finished:
+        return jsonify(job.to_dict()), 202, {"Retry-After": "1"}
+    return jsonify(job.to_dict())
 
 @app.route("/save_recipe", methods=["POST"])
 @login_required
 def save_recipe():
-    """Save recipe as a meal to Firestore and update user nutrition with simple dict cache."""
+    """Save recipe as a meal and record it in the shared recipes."""
     try:
         user_id = session.get("user_id")
         data = request.get_json()
         recipe_data = data.get("recipe_data") if data else None
-        meal_time = data.get("meal_time", "meal") if data else "meal"
+        meal_time = board_for(data.get("meal_time", "meal") if data else "meal")
+        if meal_time == ALL:
+            meal_time = "meal"  # unknown or non-string meal times are saved as a plain meal
 
         if not recipe_data or not isinstance(recipe_data, dict):
             return jsonify({"error": "No recipe data or invalid format"}), 400
@@ -791,10 +1151,11 @@ def save_recipe():
         today = dt.now().strftime("%Y-%m-%d")
 
         # ------------------------
-        # Add meal to user's collection
+        # Meal for the user's day
         # ------------------------
         meal_doc = {
             "food_name": recipe_name,
+            "recipe_id": recipe_id,
             "serving": 1.0,
             "carb": carbs,
             "protein": protein,
@@ -808,41 +1169,29 @@ def save_recipe():
             },
             "created_at": dt.now().isoformat()
         }
-        db.collection("users").document(user_id).collection("meals").add(meal_doc)
 
         # ------------------------
-        # Add to shared recipes collection using simple cache
+        # Add the meal and add to shared recipes (or count another use) in one commit
         # ------------------------
-        recipe_ref = db.collection("recipes").document(recipe_id)
-
-        if recipe_id in shared_recipe_cache:
-            # Recipe already cached, just increment times_used
-            recipe_ref.update({
-                "times_used": firestore.Increment(1)
-            })
-        else:
-            recipe_doc = recipe_ref.get()
-            if recipe_doc.exists:
-                recipe_ref.update({
-                    "times_used": firestore.Increment(1)
-                })
-            else:
-                # New recipe
-                new_recipe = {
-                    "name": recipe_name,
-                    "calories": calories,
-                    "protein": protein,
-                    "carbs": carbs,
-                    "ingredients": recipe_data.get("ingredients", []),
-                    "steps": recipe_data.get("steps", []),
-                    "created_by": user_id,
-                    "created_at": dt.now().isoformat(),
-                    "times_used": 1
-                }
-                recipe_ref.set(new_recipe)
-
-            # Add to in-memory cache
-            shared_recipe_cache[recipe_id] = True
+        recipe = {
+            "name": recipe_name,
+            "calories": calories,
+            "protein": protein,
+            "carbs": carbs,
+            "meal_time": meal_time,
+            "ingredients": recipe_data.get("ingredients", []),
+            "steps": recipe_data.get("steps", []),
+            "created_by": user_id,
+            "created_at": dt.now().isoformat()
+        }
+        created = storage.add_recipe_meal(user_id, today, meal_doc, recipe_id, recipe)
+        trending.record(recipe_id, recipe, meal_time)
+        if created:
+            food_index.add_recipe(recipe_name)
+            catalog_snapshot.add_recipe(recipe_name, calories, carbs, protein)
+            # A new recipe can change its name's lookup and any autocomplete result
+            food_cache.invalidate(recipe_id)
+            search_cache.clear()
 
         return jsonify({"status": "success", "message": "Recipe saved!"})
     except Exception as e:
@@ -0,0 +1,667 @@
+"""
+Microbenchmarks for the app's pure hot-path functions.
+
+Usage:
+    python benchmark.py [--filter TEXT] [--output results.json] [--compare baseline.json]
+    python benchmark.py --cold-start [--against REV]
+    python benchmark.py --fuzz 5000 [--corpus recipe_cache.db]
+
+Fixtures are generated from fixed seeds and the bundled neutrino.db, so
+runs are comparable across machines and commits. Results are written as
+JSON (stdout by default). With --compare, cases whose median got slower
+than --threshold relative to the baseline are reported and the exit code
+is 1, so a run can gate a deploy.
+
+--cold-start instead measures what a fresh serverless instance pays:
+importing app.py and serving its first request, each in a new
+interpreter, on the Firestore backend with a throwaway key and no network
+access. --against REV runs the same measurement on an older commit
+(exported with git archive) and reports the before/after change, or the
+error if that commit cannot start.
+
+--fuzz mutates a corpus of recipe replies (the fixtures below, plus the
+raw replies stored in a recipe cache database with --corpus) and checks
+that every parser returns the documented shape without raising.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+from catalog import CATALOG_DB, FOOD, RECIPE, CatalogSnapshot, PrefixIndex, load_food_names
+
+SEED = 1014
+CASES = []
+
+
+def case(name):
+    """Register a benchmark. The function receives nothing and returns the callable to time."""
+    def register(setup):
+        CASES.append((name, setup))
+        return setup
+    return register
+
+
+def load_app():
+    """Import app.py against a throwaway SQLite copy so no cloud services are touched."""
+    if "app" not in sys.modules:
+        path = os.path.join(tempfile.mkdtemp(prefix="nutrino-bench-"), "bench.db")
+        shutil.copyfile(CATALOG_DB, path)
+        os.environ["STORAGE_BACKEND"] = "sqlite"
+        os.environ["SQLITE_PATH"] = path
+        os.environ["SHARED_CACHE_URL"] = os.path.join(os.path.dirname(path), "shared_cache.db")
+        os.environ.setdefault("GEMINI_API", "benchmark")
+    import app
+    return app
+
+
+# ------------------------
+# Fixtures
+# ------------------------
+RECIPE_TEXT = """**Recipe Name:** Spiced Chickpea and Spinach Bowl
+
+**Ingredients:**
+- 1 cup cooked chickpeas
+- 2 cups fresh spinach, chopped
+- 1 medium tomato, diced
+- 1 small onion, finely chopped
+- 2 cloves garlic, minced
+- 1 tsp cumin seeds
+- 1/2 tsp turmeric
+- 1 tbsp olive oil
+- Salt and pepper to taste
+
+**Steps:**
+1. Heat the olive oil in a pan over medium heat and add the cumin seeds.
+2. Add the onion and garlic and cook until soft, about 4 minutes.
+3. Stir in the tomato and turmeric and cook until the tomato breaks down.
+4. Add the chickpeas and spinach, cover, and cook for 3 minutes.
+5. Season with salt and pepper and serve warm.
+
+**Nutrition:** Calories: 420, Protein: 18g, Carbs: 52g
+"""
+
+MALFORMED_RECIPES = [
+    # Inline sections on one line
+    "**Recipe Name:** Oat Porridge **Ingredients:** - oats - milk - honey "
+    "**Steps:** 1. Boil milk. 2. Add oats. 3. Stir in honey. **Nutrition:** Calories: 310, Protein: 11g, Carbs: 48g",
+    # Missing nutrition and steps
+    "**Recipe Name:** Plain Rice\n\n**Ingredients:**\n- 1 cup rice\n- 2 cups water\n",
+    # Non-numeric nutrition values
+    RECIPE_TEXT.replace("Calories: 420", "Calories: about 420").replace("18g", "eighteen g"),
+    # No markers at all
+    "I'm sorry, I can't create a recipe with those ingredients. Please try different ones.",
+    # Empty response
+    "",
+]
+
+RECIPE_VARIANTS = [
+    # Star bullets, ")" numbering, hyphenated ingredients and wrapped steps
+    "**Recipe Name:** Masala Oats\n**Ingredients:**\n* 1/2 cup rolled oats\n* 1 cup low-fat milk\n"
+    "* 1 green chilli, finely chopped\n**Steps:**\n1) Dry-roast the oats for 2 minutes.\n"
+    "2) Add the milk and chilli and simmer,\n   stirring often, until thick.\n"
+    "**Nutrition:** Calories: 280.5, Protein: 12.5g, Carbs: 41g.",
+    # Structured output
+    json.dumps({
+        "name": "Paneer Wrap",
+        "ingredients": ["1 whole-wheat roti", "50 g paneer", "1/4 cup mint-coriander chutney"],
+        "steps": ["Warm the roti.", "Fill with paneer and chutney.", "Roll and serve."],
+        "calories": 390, "protein": 21, "carbs": 38,
+    }),
+    # Structured output wrapped in a code fence
+    "```json\n" + json.dumps({"name": "Egg Bhurji", "ingredients": ["2 eggs"], "steps": ["Scramble."],
+                               "calories": "180 kcal", "protein": "12g", "carbs": 3}) + "\n```",
+]
+
+RECIPE_CORPUS = [RECIPE_TEXT] + MALFORMED_RECIPES + RECIPE_VARIANTS
+
+
+def meal_list(size, seed=SEED):
+    """A day's meals in the stored shape, with deterministic values."""
+    rng = random.Random(seed)
+    return [
+        {
+            "meal_id": f"m{i:06d}",
+            "food_name": f"Food {rng.randrange(1000)}",
+            "serving": rng.choice([0.5, 1.0, 1.5, 2.0]),
+            "carb": round(rng.uniform(0, 90), 2),
+            "protein": round(rng.uniform(0, 40), 2),
+            "kcal": round(rng.uniform(20, 800), 2),
+        }
+        for i in range(size)
+    ]
+
+
+def autocomplete_queries(names, count=200, seed=SEED):
+    """Prefixes of real catalog words, 1 to 6 characters long, plus a few misses."""
+    rng = random.Random(seed)
+    words = sorted({word for name in names for word in name.lower().split() if word.isalpha()})
+    queries = [rng.choice(words)[:rng.randint(1, 6)] for _ in range(count - 10)]
+    return queries + [f"zz{i}" for i in range(10)]
+
+
+# ------------------------
+# Cases
+# ------------------------
+@case("parse_recipe_response/realistic")
+def bench_parse_realistic():
+    parse = load_app().parse_recipe_response
+    return lambda: parse(RECIPE_TEXT)
+
+
+@case("parse_recipe_response/malformed")
+def bench_parse_malformed():
+    parse = load_app().parse_recipe_response
+
+    def run():
+        for text in MALFORMED_RECIPES:
+            parse(text)
+    return run
+
+
+@case("parse_recipe_response/json")
+def bench_parse_json():
+    parse = load_app().parse_recipe_response
+    return lambda: parse(RECIPE_VARIANTS[1])
+
+
+@case("parse_recipe_response/corpus")
+def bench_parse_corpus():
+    parse = load_app().parse_recipe_response
+
+    def run():
+        for text in RECIPE_CORPUS:
+            parse(text)
+    return run
+
+
+@case("recipe_stream/chunked")
+def bench_recipe_stream():
+    from recipe_stream import RecipeStreamParser
+    chunks = [RECIPE_TEXT[i:i + 24] for i in range(0, len(RECIPE_TEXT), 24)]
+
+    def run():
+        parser = RecipeStreamParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+        parser.finish()
+    return run
+
+
+@case("format_recipe_html")
+def bench_format_html():
+    app = load_app()
+    recipe = app.parse_recipe_response(RECIPE_TEXT)
+    return lambda: app.format_recipe_html(recipe)
+
+
+@case("day_totals/1000_meals")
+def bench_day_totals():
+    from daylog import day_totals
+    meals = meal_list(1000)
+    return lambda: day_totals(meals)
+
+
+@case("meal_entries/1000_meals")
+def bench_meal_entries():
+    from daylog import meal_entries
+    meals = meal_list(1000)
+    return lambda: meal_entries(meals)
+
+
+@case("nutrient_totals/1000_meals")
+def bench_nutrient_totals():
+    from catalog import get_nutrient_matrix
+    from daylog import nutrient_totals
+    codes = get_nutrient_matrix().codes
+    meals = meal_list(1000)
+    for i, meal in enumerate(meals):
+        meal["food_code"] = codes[(i * 7919) % len(codes)]
+    return lambda: nutrient_totals(meals)
+
+
+@case("generate_search_keywords/catalog")
+def bench_search_keywords():
+    from food_data import generate_search_keywords
+    names = load_food_names()
+
+    def run():
+        for name in names:
+            generate_search_keywords(name)
+    return run
+
+
+@case("autocomplete/index_build")
+def bench_index_build():
+    entries = [(name, FOOD) for name in load_food_names()]
+    entries += [(f"Recipe {i}", RECIPE) for i in range(200)]
+    return lambda: PrefixIndex(entries)
+
+
+@case("autocomplete/index_search")
+def bench_index_search():
+    names = load_food_names()
+    index = PrefixIndex([(name, FOOD) for name in names])
+    queries = autocomplete_queries(names)
+
+    def run():
+        for query in queries:
+            index.search(query)
+    return run
+
+
+@case("autocomplete/route_uncached")
+def bench_autocomplete_route():
+    app = load_app()
+    app.food_index.refresh_async()
+    deadline = time.time() + 30
+    while not app.food_index.ready and time.time() < deadline:
+        time.sleep(0.05)
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = "benchmark"
+    queries = autocomplete_queries(load_food_names(), count=50)
+
+    def run():
+        app.search_cache.clear()
+        for query in queries:
+            client.get("/addmeal", query_string={"q": query})
+    return run
+
+
+@case("shared_cache/get_from_shared_tier")
+def bench_shared_cache():
+    from cache import TTLCache
+    from shared_cache import SQLiteBackend, TieredCache
+    path = os.path.join(tempfile.mkdtemp(prefix="nutrino-bench-"), "shared_cache.db")
+    cache = TieredCache("food", TTLCache(ttl=300), SQLiteBackend(path))
+    keys = [f"food_{i}" for i in range(200)]
+    for key in keys:
+        cache.set(key, {"calories": 120.5, "carbs": 20.1, "protein": 3.2, "food_code": key})
+
+    def run():
+        cache.local.clear()  # every lookup misses locally and is answered by the shared tier
+        for key in keys:
+            cache.get(key)
+    return run
+
+
+@case("trending/record_and_top")
+def bench_trending():
+    from trending import TrendingRecipes
+    rng = random.Random(SEED)
+    recipes = [{"name": f"Recipe {i}", "calories": 200 + i % 700} for i in range(2000)]
+    saves = [(rng.randrange(len(recipes)), rng.choice(("breakfast", "lunch", "dinner"))) for _ in range(1000)]
+
+    def run():
+        trending = TrendingRecipes()
+        for i, meal_time in saves:
+            trending.record(f"recipe_{i}", recipes[i], meal_time)
+            trending.top(meal_time, limit=5, max_kcal=600)
+    return run
+
+
+@case("catalog_snapshot/build")
+def bench_snapshot_build():
+    recipes = [{"name": f"Recipe {i}", "calories": 300 + i, "carbs": 40, "protein": 15} for i in range(200)]
+    snapshot = CatalogSnapshot(recipe_loader=lambda: recipes)
+    return snapshot._build
+
+
+# ------------------------
+# Runner
+# ------------------------
+def measure(fn, repeat, min_time):
+    """Time fn like timeit: calibrate a loop count, then take `repeat` samples per call."""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        if time.perf_counter() - start >= min_time or loops >= 1 << 20:
+            break
+        loops *= 2
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        samples.append((time.perf_counter() - start) / loops)
+    return summarize(samples, loops)
+
+
+def summarize(samples, loops=1):
+    samples = sorted(samples)
+    return {
+        "loops": loops,
+        "repeat": len(samples),
+        "min_s": samples[0],
+        "median_s": statistics.median(samples),
+        "mean_s": statistics.fmean(samples),
+        "max_s": samples[-1],
+        "stdev_s": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def git_revision(rev="HEAD"):
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", rev], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def report_for(results, revision=None):
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": revision or git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def run(name_filter=None, repeat=5, min_time=0.2):
+    results = {}
+    for name, setup in CASES:
+        if name_filter and name_filter not in name:
+            continue
+        fn = setup()
+        fn()  # warm up caches and lazy imports before timing
+        results[name] = measure(fn, repeat, min_time)
+        print(f"{name:45s} {results[name]['median_s'] * 1e6:12.1f} us", file=sys.stderr)
+    return report_for(results)
+
+
+# ------------------------
+# Cold start
+# ------------------------
+COLD_START_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get("/login")
+print(json.dumps({"import": imported - start, "first_request": time.perf_counter() - imported}))
+"""
+
+
+def export_revision(rev):
+    """Extract the tree at rev into a temporary directory and return its path."""
+    path = tempfile.mkdtemp(prefix=f"nutrino-{rev.replace('/', '_')}-")
+    archive = subprocess.run(["git", "archive", "--format=tar", rev], capture_output=True, check=True)
+    with tempfile.TemporaryFile() as f:
+        f.write(archive.stdout)
+        f.seek(0)
+        with tarfile.open(fileobj=f) as tar:
+            tar.extractall(path)
+    return path
+
+
+# Installed as sitecustomize in the cold-start interpreters: trees that load
+# serviceAccountKey.json from their working directory get a throwaway key
+STUB_SITECUSTOMIZE = """
+import importlib.abc, importlib.util, os, sys
+
+class StubServiceAccount(importlib.abc.MetaPathFinder):
+    def find_spec(self, name, path=None, target=None):
+        if name != "firebase_admin.credentials":
+            return None
+        sys.meta_path.remove(self)
+        spec = importlib.util.find_spec(name)
+        exec_module = spec.loader.exec_module
+
+        def exec_patched(module):
+            exec_module(module)
+            certificate = module.Certificate
+            module.Certificate = lambda cert: certificate(
+                os.environ["BENCH_SERVICE_ACCOUNT"] if isinstance(cert, str) and not os.path.exists(cert) else cert
+            )
+
+        spec.loader.exec_module = exec_patched
+        return spec
+
+sys.meta_path.insert(0, StubServiceAccount())
+"""
+
+
+def write_service_account(path):
+    """Write a service-account key that parses like a real one but grants nothing."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    with open(path, "w") as f:
+        json.dump({
+            "type": "service_account", "project_id": "nutrino-benchmark", "private_key_id": "benchmark",
+            "private_key": pem, "client_email": "benchmark@nutrino-benchmark.iam.gserviceaccount.com",
+            "client_id": "0", "token_uri": "https://oauth2.googleapis.com/token",
+        }, f)
+
+
+def cold_start(tree, repeat):
+    """
+    Time `import app` and the first GET /login in fresh interpreters.
+
+    Both trees run on the Firestore backend, so Firestore and Gemini client
+    set-up is part of what is measured wherever a tree does it. Credentials
+    are a throwaway service-account key (given to trees that read
+    serviceAccountKey.json through a sitecustomize stub), and
+    FIRESTORE_EMULATOR_HOST points at a closed local port, so any query a
+    tree makes fails at once instead of leaving the machine. One unmeasured
+    run first fills the Jinja bytecode cache, as on a warm instance whose
+    /tmp survived a worker restart. Returns {"error": ...} if the tree
+    cannot start.
+    """
+    scratch = tempfile.mkdtemp(prefix="nutrino-cold-")
+    stubs = os.path.join(scratch, "stubs")
+    os.makedirs(stubs)
+    with open(os.path.join(stubs, "sitecustomize.py"), "w") as f:
+        f.write(STUB_SITECUSTOMIZE)
+    write_service_account(os.path.join(scratch, "service_account.json"))
+    env = dict(
+        os.environ,
+        STORAGE_BACKEND="firestore",
+        GEMINI_API=os.environ.get("GEMINI_API", "benchmark"),
+        BENCH_SERVICE_ACCOUNT=os.path.join(scratch, "service_account.json"),
+        FIRESTORE_EMULATOR_HOST="127.0.0.1:9",
+        PYTHONPATH=os.pathsep.join(filter(None, [stubs, os.environ.get("PYTHONPATH")])),
+        JINJA_CACHE_DIR=os.path.join(scratch, "jinja"),
+        RECIPE_CACHE_PATH=os.path.join(scratch, "recipes.db"),
+        SHARED_CACHE_URL="none",
+    )
+    samples = {"import": [], "first_request": [], "process": []}
+    try:
+        for i in range(repeat + 1):
+            start = time.perf_counter()
+            run = subprocess.run(
+                [sys.executable, "-c", COLD_START_SCRIPT], cwd=tree, env=env, capture_output=True, text=True,
+            )
+            elapsed = time.perf_counter() - start
+            if run.returncode != 0:
+                lines = run.stderr.strip().splitlines()
+                return {"error": lines[-1] if lines else f"exit status {run.returncode}"}
+            if i == 0:
+                continue
+            timings = json.loads(run.stdout.strip().splitlines()[-1])
+            samples["import"].append(timings["import"])
+            samples["first_request"].append(timings["first_request"])
+            samples["process"].append(elapsed)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return {f"cold_start/{name}": summarize(values) for name, values in samples.items()}
+
+
+def run_cold_start(repeat, against=None):
+    results = cold_start(os.path.dirname(os.path.abspath(__file__)), repeat)
+    if "error" in results:
+        print(f"cold start failed: {results['error']}", file=sys.stderr)
+        return {"error": results["error"]}
+    for name, result in results.items():
+        print(f"{name:45s} {result['median_s'] * 1e3:12.1f} ms", file=sys.stderr)
+    report = report_for(results)
+    if against:
+        tree = export_revision(against)
+        try:
+            before = cold_start(tree, repeat)
+        finally:
+            shutil.rmtree(tree, ignore_errors=True)
+        if "error" in before:
+            print(f"cold start of {against} failed: {before['error']}", file=sys.stderr)
+            report["against"] = {"git_revision": git_revision(against), "error": before["error"]}
+            return report
+        report["against"] = report_for(before, git_revision(against))
+        for name, result in results.items():
+            old, new = before[name]["median_s"], result["median_s"]
+            print(f"{name:45s} {old * 1e3:9.1f} ms -> {new * 1e3:9.1f} ms ({old / new:.2f}x faster)", file=sys.stderr)
+    return report
+
+
+def compare(report, baseline, threshold):
+    """Return [(name, old, new, ratio)] for cases slower than baseline by more than threshold."""
+    regressions = []
+    for name, result in report["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old or not old.get("median_s"):
+            continue
+        ratio = result["median_s"] / old["median_s"]
+        if ratio > 1 + threshold:
+            regressions.append((name, old["median_s"], result["median_s"], ratio))
+    return regressions
+
+
+# ------------------------
+# Fuzzing
+# ------------------------
+def load_corpus(path=None):
+    """The fixture replies, plus raw replies from a recipe cache database if given."""
+    corpus = list(RECIPE_CORPUS)
+    if path:
+        import sqlite3
+        conn = sqlite3.connect(path)
+        try:
+            corpus += [row[0] for row in conn.execute("SELECT raw_text FROM recipe_cache")]
+        finally:
+            conn.close()
+    return corpus
+
+
+def mutate(text, rng):
+    """Apply one random corruption of the kind seen in model output."""
+    if not text:
+        return rng.choice(["**", "{", "**Steps:**", "1. ", "-"])
+    position = rng.randrange(len(text) + 1)
+    choice = rng.randrange(8)
+    if choice == 0:    # truncated reply
+        return text[:position]
+    if choice == 1:    # dropped span
+        return text[:position] + text[position + rng.randint(1, 40):]
+    if choice == 2:    # duplicated span
+        return text[:position] + text[max(0, position - 40):position] + text[position:]
+    if choice == 3:    # stray markup
+        return text[:position] + rng.choice(["**", "- ", "1. ", "\n", "{", "}", "```", "\u00e9", "\x00"]) + text[position:]
+    if choice == 4:    # flattened to one line
+        return text.replace("\n", " ")
+    if choice == 5:    # CRLF line endings
+        return text.replace("\n", "\r\n")
+    if choice == 6:    # marker removed
+        return text.replace(rng.choice(["**Ingredients:**", "**Steps:**", "**Nutrition:**", "**Recipe Name:**"]), "", 1)
+    return "".join(rng.sample(text, len(text))) if len(text) < 200 else text[::-1]
+
+
+def check_recipe(recipe):
+    assert isinstance(recipe, dict), f"not a dict: {recipe!r}"
+    assert isinstance(recipe["name"], str)
+    for key in ("ingredients", "steps"):
+        assert isinstance(recipe[key], list) and all(isinstance(item, str) and item for item in recipe[key]), key
+    for key in ("calories", "protein", "carbs"):
+        assert isinstance(recipe[key], (int, float)) and not isinstance(recipe[key], bool), key
+
+
+def fuzz(iterations, corpus_path=None, seed=SEED):
+    """Run mutated replies through every parser; returns a report with any failures."""
+    from recipe_stream import RecipeStreamParser, parse_recipe_response, parse_recipe_text
+
+    rng = random.Random(seed)
+    corpus = load_corpus(corpus_path)
+    failures = []
+    for i in range(iterations):
+        text = rng.choice(corpus)
+        for _ in range(rng.randint(1, 3)):
+            text = mutate(text, rng)
+        try:
+            check_recipe(parse_recipe_response(text))
+            check_recipe(parse_recipe_text(text))
+            parser = RecipeStreamParser()
+            events = []
+            position = 0
+            while position < len(text):
+                size = rng.randint(1, 64)
+                events += parser.feed(text[position:position + size])
+                position += size
+            events += parser.finish()
+            sections = dict(events)
+            # Streaming and whole-text parsing must agree on every section
+            whole = parse_recipe_text(text)
+            for section in ("ingredients", "steps"):
+                if section in sections:
+                    assert sections[section] == whole[section], f"stream/whole mismatch in {section}"
+        except Exception as e:
+            failures.append({"iteration": i, "error": f"{type(e).__name__}: {e}", "input": text[:500]})
+    return {"iterations": iterations, "corpus": len(corpus), "seed": seed, "failures": failures}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", help="only run cases whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5, help="timed samples per case")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per sample")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown, 0.10 = 10%%")
+    parser.add_argument("--cold-start", action="store_true", help="measure import and first request instead")
+    parser.add_argument("--against", metavar="REV", help="with --cold-start, also measure this git revision")
+    parser.add_argument("--fuzz", type=int, metavar="N", help="fuzz the recipe parsers with N inputs instead")
+    parser.add_argument("--corpus", help="with --fuzz, also use the replies in this recipe cache database")
+    args = parser.parse_args()
+
+    if args.fuzz:
+        report = fuzz(args.fuzz, args.corpus)
+        print(json.dumps(report, indent=2))
+        print(f"{len(report['failures'])} failures in {args.fuzz} inputs", file=sys.stderr)
+        sys.exit(1 if report["failures"] else 0)
+    if args.cold_start:
+        report = run_cold_start(args.repeat, args.against)
+    else:
+        report = run(args.filter, args.repeat, args.min_time)
+    encoded = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(encoded + "\n")
+    else:
+        print(encoded)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for name, old, new, ratio in regressions:
+            print(f"REGRESSION {name}: {old * 1e6:.1f} us -> {new * 1e6:.1f} us ({ratio:.2f}x)", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
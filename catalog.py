@@ -0,0 +1,575 @@
+import bisect
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+CATALOG_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "neutrino.db")
+REFRESH_INTERVAL = 600  # seconds (10 minutes)
+
+FOOD = 0
+RECIPE = 1
+
+_word_re = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens."""
+    return _word_re.findall(text.lower())
+
+
+# Stored search keywords: edge n-grams of each word plus a few word-pair tokens
+MIN_GRAM = 2
+MAX_GRAM = 5
+MAX_PAIRS = 2
+MAX_KEYWORDS = 40
+STOP_WORDS = frozenset({"a", "and", "for", "in", "of", "on", "or", "the", "to", "with"})
+
+
+def _keyword_words(text):
+    words = tokenize(text)
+    return [word for word in words if word not in STOP_WORDS] or words
+
+
+def search_keywords(name):
+    """
+    Keywords stored with a food or recipe for Firestore array_contains search.
+
+    Each word contributes its prefixes of MIN_GRAM to MAX_GRAM characters
+    (shorter words are kept whole), and the first MAX_PAIRS adjacent word
+    pairs add a "<word[:MAX_GRAM]> <next word's first letter>" token that
+    narrows multi-word queries. Longer queries are matched by querying a
+    truncated keyword and filtering the hits with matches_query.
+
+    Past MAX_KEYWORDS, every word keeps its longest gram and the pairs, so
+    a query for any whole word still finds the name; only the shorter
+    in-between grams are dropped, longest first.
+    """
+    words = _keyword_words(name)
+    keywords = dict.fromkeys(word[:MAX_GRAM] for word in words)
+    for first, second in list(zip(words, words[1:]))[:MAX_PAIRS]:
+        keywords[f"{first[:MAX_GRAM]} {second[0]}"] = None
+    for length in range(MIN_GRAM, MAX_GRAM):
+        for word in words:
+            if len(keywords) >= MAX_KEYWORDS:
+                break
+            if len(word) > length:
+                keywords.setdefault(word[:length])
+    return sorted(list(keywords)[:MAX_KEYWORDS])
+
+
+def query_keywords(query):
+    """
+    Keywords to look up for a search query, most selective first.
+
+    Returns [] when the query is too short to have a stored keyword.
+    """
+    words = _keyword_words(query)
+    if not words or max(len(word) for word in words) < MIN_GRAM:
+        return []
+    keywords = []
+    if len(words) > 1:
+        keywords.append(f"{words[0][:MAX_GRAM]} {words[1][0]}")
+    longest = max(words, key=len)
+    keywords.append(longest[:MAX_GRAM])
+    return keywords
+
+
+def matches_query(name, query):
+    """True if every word of query is a prefix of some word of name."""
+    name_words = tokenize(name)
+    return all(any(word.startswith(q) for word in name_words) for q in tokenize(query))
+
+
+def rank_key(name, kind, query):
+    """Sort key for search hits: foods first, then names starting with query, shortest first."""
+    return (kind, not name.lower().startswith(query), len(name), name)
+
+
+class PrefixIndex:
+    """
+    Immutable sorted-array prefix index over food and recipe names.
+
+    Every word of every name is stored once in a sorted token list, so a
+    prefix lookup is two bisects and multi-word queries intersect the
+    matches of each query word.
+    """
+
+    def __init__(self, entries=()):
+        names = []
+        kinds = []
+        seen = set()
+        for name, kind in entries:
+            key = (name or "").strip()
+            if not key or key.lower() in seen:
+                continue
+            seen.add(key.lower())
+            names.append(key)
+            kinds.append(kind)
+
+        pairs = sorted(
+            (token, name_id)
+            for name_id, name in enumerate(names)
+            for token in set(tokenize(name))
+        )
+        self.names = names
+        self.kinds = kinds
+        self._tokens = [token for token, _ in pairs]
+        self._ids = [name_id for _, name_id in pairs]
+
+    def __len__(self):
+        return len(self.names)
+
+    def _prefix_ids(self, prefix):
+        lo = bisect.bisect_left(self._tokens, prefix)
+        hi = bisect.bisect_left(self._tokens, prefix + "\uffff", lo)
+        return set(self._ids[lo:hi])
+
+    def search(self, query, limit=5):
+        """Return up to `limit` names whose words start with every query word."""
+        words = tokenize(query)
+        if not words:
+            return []
+
+        matches = None
+        for word in sorted(set(words), key=len, reverse=True):
+            ids = self._prefix_ids(word)
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                return []
+
+        query = " ".join(words)
+        ranked = sorted(matches, key=lambda i: rank_key(self.names[i], self.kinds[i], query))
+        return [self.names[i] for i in ranked[:limit]]
+
+
+def decode_text(raw):
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("latin-1")
+
+
+def connect(db_path=CATALOG_DB):
+    """Open the catalog database, tolerating the latin-1 rows in food_data."""
+    conn = sqlite3.connect(db_path)
+    conn.text_factory = decode_text
+    return conn
+
+
+def load_food_names(db_path=CATALOG_DB):
+    """Read every food name from the local food_data catalog."""
+    conn = connect(db_path)
+    try:
+        return [row[0] for row in conn.execute("SELECT food_name FROM food_data")]
+    finally:
+        conn.close()
+
+
+class FoodIndex:
+    """
+    Per-worker autocomplete index over food_data and known recipe names.
+
+    The index is built in a background thread the first time it is used and
+    rebuilt whenever recipes are added or REFRESH_INTERVAL has passed. Until
+    the first build finishes `search` returns None so the caller can fall
+    back to Firestore.
+    """
+
+    def __init__(self, recipe_loader=None, db_path=CATALOG_DB):
+        self.recipe_loader = recipe_loader
+        self.db_path = db_path
+        self._index = None
+        self._foods = None
+        self._recipes = set()
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._dirty = False
+        self._reload = True
+
+    @property
+    def ready(self):
+        return self._index is not None
+
+    def _load_recipes(self):
+        try:
+            loaded = [name for name in self.recipe_loader() if name]
+        except Exception as e:
+            print(f"Error loading recipe names: {e}")
+            return
+        with self._lock:
+            self._recipes.update(loaded)
+
+    def _build(self):
+        while True:
+            with self._lock:
+                if not self._dirty:
+                    self._refreshing = False
+                    return
+                self._dirty = False
+                reload, self._reload = self._reload, False
+            try:
+                if self._foods is None:
+                    self._foods = load_food_names(self.db_path)
+                if reload:
+                    self._loaded_at = time.time()
+                    if self.recipe_loader:
+                        self._load_recipes()
+                with self._lock:
+                    recipes = list(self._recipes)
+                entries = [(name, FOOD) for name in self._foods]
+                entries += [(name, RECIPE) for name in recipes]
+                self._index = PrefixIndex(entries)
+            except Exception as e:
+                print(f"Error building food index: {e}")
+
+    def refresh_async(self, reload=False):
+        """Rebuild the index in a background thread unless one is running."""
+        with self._lock:
+            self._dirty = True
+            self._reload = self._reload or reload
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._build, daemon=True).start()
+
+    def add_recipe(self, name):
+        """Record a newly saved recipe name and rebuild in the background."""
+        name = (name or "").strip()
+        with self._lock:
+            if not name or name in self._recipes:
+                return
+            self._recipes.add(name)
+        self.refresh_async()
+
+    def search(self, query, limit=5):
+        """Return matching names, or None while the index is not built yet."""
+        stale = time.time() - self._loaded_at > REFRESH_INTERVAL
+        if stale and not self._refreshing:
+            self.refresh_async(reload=True)
+        index = self._index
+        if index is None:
+            return None
+        return index.search(query, limit)
+
+
+NUTRIENT_ALIASES = {
+    "kcal": "energy_kcal",
+    "calories": "energy_kcal",
+    "kj": "energy_kj",
+    "carbs": "carb_g",
+    "fiber": "fibre_g",
+}
+
+
+class NutrientMatrix:
+    """
+    Columnar float matrix of the nutrient fields in the food catalog.
+
+    The TEXT columns of food_data are parsed once into two (foods x
+    nutrients) arrays, one per 100 g and one per serving. Missing values are
+    NaN, so they never satisfy a filter and sort last.
+    """
+
+    def __init__(self, codes, names, units, nutrients, per_100g, per_serving):
+        self.codes = codes
+        self.names = names
+        self.units = units
+        self.nutrients = nutrients
+        self._values = {"100g": per_100g, "serving": per_serving}
+        self._columns = {nutrient: i for i, nutrient in enumerate(nutrients)}
+        self._rows = {code: i for i, code in enumerate(codes)}
+        self._by_name = {}
+        for i, name in enumerate(names):
+            self._by_name.setdefault((name or "").strip().lower(), i)
+        # NaN-free copies for sums, where a missing value counts as zero
+        self._filled = {basis: _nan_to_zero(values) for basis, values in self._values.items()}
+        for nutrient in nutrients:
+            short = nutrient.rsplit("_", 1)[0]
+            self._columns.setdefault(short, self._columns[nutrient])
+        for alias, nutrient in NUTRIENT_ALIASES.items():
+            self._columns[alias] = self._columns[nutrient]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, food_code):
+        return food_code in self._rows
+
+    @classmethod
+    def from_db(cls, db_path=CATALOG_DB):
+        """Build the matrix from the food_data table."""
+        import numpy as np
+
+        conn = connect(db_path)
+        try:
+            cursor = conn.execute("SELECT * FROM food_data ORDER BY food_code")
+            columns = [c[0] for c in cursor.description]
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        nutrients = columns[columns.index("primarysource") + 1:columns.index("servings_unit")]
+        per_100g = [columns.index(n) for n in nutrients]
+        per_serving = [columns.index(f"unit_serving_{n}") for n in nutrients]
+
+        def to_matrix(indexes):
+            return np.array(
+                [[_to_float(row[i]) for i in indexes] for row in rows],
+                dtype=np.float64,
+            ).reshape(len(rows), len(indexes)).copy(order="F")
+
+        return cls(
+            codes=[row[columns.index("food_code")] for row in rows],
+            names=[row[columns.index("food_name")] for row in rows],
+            units=[row[columns.index("servings_unit")] for row in rows],
+            nutrients=nutrients,
+            per_100g=to_matrix(per_100g),
+            per_serving=to_matrix(per_serving),
+        )
+
+    def find(self, food_name):
+        """Return the food_code for an exact (case-insensitive) name, or None."""
+        row = self._by_name.get((food_name or "").strip().lower())
+        return None if row is None else self.codes[row]
+
+    def macros(self, food_code):
+        """Per-serving kcal, carb and protein for a food_code, or None if unknown."""
+        row = self._rows.get(food_code)
+        if row is None:
+            return None
+        values = self._filled["serving"]
+        return {
+            key: float(values[row, self._columns[nutrient]])
+            for key, nutrient in (("kcal", "energy_kcal"), ("carb", "carb_g"), ("protein", "protein_g"))
+        }
+
+    def totals(self, food_codes, servings, basis="serving"):
+        """
+        Sum every nutrient over foods eaten in the given servings.
+
+        One gather and one vector-matrix product; unknown codes are
+        skipped and missing values count as zero.
+        """
+        import numpy as np
+
+        rows = [self._rows.get(code, -1) for code in food_codes]
+        keep = [i for i, row in enumerate(rows) if row >= 0]
+        weights = np.asarray([float(servings[i]) for i in keep], dtype=np.float64)
+        values = self._filled[basis][[rows[i] for i in keep]]
+        summed = weights @ values if keep else np.zeros(len(self.nutrients))
+        return dict(zip(self.nutrients, summed.tolist()))
+
+    def resolve(self, nutrient):
+        """Map a nutrient name or alias to its canonical column name."""
+        index = self._columns.get((nutrient or "").strip().lower())
+        if index is None:
+            raise ValueError(f"Unknown nutrient: {nutrient}")
+        return self.nutrients[index]
+
+    def column(self, nutrient, basis="serving"):
+        if basis not in self._values:
+            raise ValueError(f"Unknown basis: {basis}")
+        return self._values[basis][:, self._columns[self.resolve(nutrient)]]
+
+    def score(self, expression, basis="serving"):
+        """Evaluate a sort key: a nutrient name or a ratio like 'protein/kcal'."""
+        import numpy as np
+
+        if "/" not in expression:
+            return self.column(expression, basis)
+        numerator, denominator = expression.split("/", 1)
+        top = self.column(numerator, basis)
+        bottom = self.column(denominator, basis)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = top / bottom
+        ratio[~np.isfinite(ratio)] = np.nan
+        return ratio
+
+    def query(self, filters=(), sort=None, descending=True, limit=20, basis="serving"):
+        """
+        Filter and rank the catalog in a single vectorized pass.
+
+        `filters` is an iterable of (nutrient, "min" | "max", value). Returns
+        a list of dicts with the food, the sort score and every nutrient
+        that was filtered or sorted on.
+        """
+        import numpy as np
+
+        mask = np.ones(len(self), dtype=bool)
+        shown = ["energy_kcal", "carb_g", "protein_g"]
+        for nutrient, op, value in filters:
+            column = self.column(nutrient, basis)
+            if op == "min":
+                mask &= column >= value
+            elif op == "max":
+                mask &= column <= value
+            else:
+                raise ValueError(f"Unknown filter: {op}")
+            shown.append(self.resolve(nutrient))
+
+        candidates = np.flatnonzero(mask)
+        scores = None
+        if sort:
+            scores = self.score(sort, basis)[candidates]
+            keys = np.where(np.isnan(scores), -np.inf if descending else np.inf, scores)
+            if descending:
+                keys = -keys
+            if 0 < limit < len(candidates):
+                top = np.argpartition(keys, limit - 1)[:limit]
+                order = top[np.argsort(keys[top], kind="stable")]
+            else:
+                order = np.argsort(keys, kind="stable")
+            shown += [self.resolve(part) for part in sort.split("/")]
+        else:
+            order = np.arange(len(candidates))
+        order = order[:limit] if limit > 0 else order
+
+        shown = list(dict.fromkeys(shown))
+        values = self._values[basis][:, [self.nutrients.index(n) for n in shown]]
+        results = []
+        for position in order:
+            row = candidates[position]
+            item = {
+                "food_code": self.codes[row],
+                "food_name": self.names[row],
+                "servings_unit": self.units[row],
+            }
+            for nutrient, value in zip(shown, values[row]):
+                item[nutrient] = None if np.isnan(value) else round(float(value), 3)
+            if scores is not None:
+                score = scores[position]
+                item["score"] = None if np.isnan(score) else round(float(score), 4)
+            results.append(item)
+        return results
+
+
+def _nan_to_zero(values):
+    import numpy as np
+
+    return np.nan_to_num(values, nan=0.0)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+_nutrient_matrix = None
+_nutrient_lock = threading.Lock()
+
+
+def get_nutrient_matrix():
+    """Return the worker's nutrient matrix, building it on first use."""
+    global _nutrient_matrix
+    if _nutrient_matrix is None:
+        with _nutrient_lock:
+            if _nutrient_matrix is None:
+                _nutrient_matrix = NutrientMatrix.from_db()
+    return _nutrient_matrix
+
+
+SNAPSHOT_FIELDS = ("name", "kind", "kcal", "carb", "protein")
+SNAPSHOT_MAX_DELTA = 200  # recipes served as a delta before the base is rebuilt
+
+
+def _snapshot_row(name, kind, *macros):
+    values = [_to_float(value) for value in macros]
+    return [name, kind] + [0.0 if value != value else round(value, 1) for value in values]
+
+
+class CatalogSnapshot:
+    """
+    Versioned copy of the searchable catalog for client-side autocomplete.
+
+    The base holds every food and the recipes known when it was built, and
+    its version is a hash of that content, so the URL naming it can be
+    cached forever. Recipes saved afterwards are served as a delta against
+    the base until REFRESH_INTERVAL passes or the delta reaches
+    SNAPSHOT_MAX_DELTA, and then the base is rebuilt.
+    """
+
+    def __init__(self, recipe_loader=None):
+        self.recipe_loader = recipe_loader
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._version = None
+        self._body = None
+        self._names = set()
+        self._delta = []
+        self._built_at = 0
+
+    def _stale(self):
+        return time.time() - self._built_at > REFRESH_INTERVAL or len(self._delta) >= SNAPSHOT_MAX_DELTA
+
+    def _build(self):
+        matrix = get_nutrient_matrix()
+        rows = []
+        names = set()
+        for code, name in zip(matrix.codes, matrix.names):
+            name = (name or "").strip()
+            if not name or name.lower() in names:
+                continue
+            names.add(name.lower())
+            macros = matrix.macros(code)
+            rows.append(_snapshot_row(name, FOOD, macros["kcal"], macros["carb"], macros["protein"]))
+
+        recipes = []
+        if self.recipe_loader:
+            try:
+                recipes = self.recipe_loader()
+            except Exception as e:
+                print(f"Error loading recipes for the catalog snapshot: {e}")
+        recipe_rows = []
+        for recipe in recipes:
+            name = (recipe.get("name") or "").strip()
+            if not name or name.lower() in names:
+                continue
+            names.add(name.lower())
+            recipe_rows.append(_snapshot_row(
+                name, RECIPE, recipe.get("calories"), recipe.get("carbs"), recipe.get("protein")
+            ))
+        rows += sorted(recipe_rows)
+
+        items = json.dumps(rows, separators=(",", ":"), ensure_ascii=False)
+        version = hashlib.sha256(items.encode("utf-8")).hexdigest()[:16]
+        body = f'{{"version":"{version}","fields":{json.dumps(SNAPSHOT_FIELDS)},"items":{items}}}'
+        with self._lock:
+            self._version = version
+            self._body = body.encode("utf-8")
+            self._names = names
+            self._delta = []
+            self._built_at = time.time()
+
+    def current(self):
+        """Return (version, JSON body) of the base, rebuilding it when stale."""
+        if self._version is None or self._stale():
+            # Only one thread rebuilds; the others keep serving the old base
+            if self._build_lock.acquire(blocking=self._version is None):
+                try:
+                    if self._version is None or self._stale():
+                        self._build()
+                finally:
+                    self._build_lock.release()
+        with self._lock:
+            return self._version, self._body
+
+    def delta(self):
+        """Rows for recipes saved since the base was built."""
+        with self._lock:
+            return list(self._delta)
+
+    def add_recipe(self, name, kcal, carb, protein):
+        """Record a newly saved recipe in the delta."""
+        name = (name or "").strip()
+        with self._lock:
+            if self._version is None or not name or name.lower() in self._names:
+                return
+            self._names.add(name.lower())
+            self._delta.append(_snapshot_row(name, RECIPE, kcal, carb, protein))
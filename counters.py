@@ -0,0 +1,51 @@
+"""
+Sharded counters for frequently incremented Firestore documents.
+
+A single document sustains only about one write per second, so counting
+every save of a popular recipe on the recipe document itself makes it a
+hotspot. Increments go to one of NUM_SHARDS documents in the parent's
+`counters` subcollection instead, picked at random, and the exact value is
+the sum of the shards plus whatever the parent held before sharding.
+"""
+import os
+import random
+
+NUM_SHARDS = int(os.environ.get("COUNTER_SHARDS", 10))
+
+
+def shard_ref(parent_ref, field, shard=None):
+    if shard is None:
+        shard = random.randrange(NUM_SHARDS)
+    return parent_ref.collection("counters").document(f"{field}_{shard}")
+
+
+def increment(writer, parent_ref, field, amount=1):
+    """Add amount to a random shard through a batch or transaction."""
+    from firebase_admin import firestore
+
+    writer.set(shard_ref(parent_ref, field), {field: firestore.Increment(amount)}, merge=True)
+
+
+def total(parent_ref, field, parent_data=None):
+    """Exact counter value: the parent's own field (pre-sharding counts) plus every shard."""
+    if parent_data is None:
+        snapshot = parent_ref.get()
+        parent_data = snapshot.to_dict() if snapshot.exists else {}
+    value = parent_data.get(field) or 0
+    for snapshot in parent_ref.collection("counters").stream():
+        if snapshot.id.rsplit("_", 1)[0] == field:
+            value += (snapshot.to_dict() or {}).get(field) or 0
+    return value
+
+
+def totals_by_parent(db, collection, field):
+    """Sum every shard of `field` under documents of `collection` in one collection-group query."""
+    totals = {}
+    for snapshot in db.collection_group("counters").stream():
+        if snapshot.id.rsplit("_", 1)[0] != field:
+            continue
+        parent = snapshot.reference.parent.parent
+        if parent is None or parent.parent.id != collection:
+            continue
+        totals[parent.id] = totals.get(parent.id, 0) + ((snapshot.to_dict() or {}).get(field) or 0)
+    return totals
@@ -0,0 +1,429 @@
+"""
+Per-day meal documents.
+
+Each user/day is stored as users/{user_id}/days/{YYYY-MM-DD}, holding the
+meal list and pre-aggregated totals, so the dashboard is a single read.
+Every write goes through a transaction that recomputes the totals from the
+meal list it writes.
+"""
+import functools
+import uuid
+from collections import defaultdict
+from datetime import datetime as dt
+
+from catalog import get_nutrient_matrix
+import counters
+
+
+
+def _transactional(fn):
+    """
+    Like firestore.transactional, but applied on first call. Importing
+    firebase_admin takes a large share of a cold start, so it waits until
+    a transaction is actually run.
+    """
+    wrapped = None
+
+    @functools.wraps(fn)
+    def call(transaction, *args):
+        nonlocal wrapped
+        if wrapped is None:
+            from firebase_admin import firestore
+            wrapped = firestore.transactional(fn)
+        return wrapped(transaction, *args)
+
+    return call
+
+MIGRATED_FLAG = "days_migrated"
+LEGACY_COPIED = "copied_to_day"  # set on legacy meal docs once they are in a day document
+
+
+def day_ref(db, user_id, date):
+    return db.collection("users").document(user_id).collection("days").document(date)
+
+
+def new_meal_id():
+    return uuid.uuid4().hex[:20]
+
+
+def meal_macros(meal, matrix=None):
+    """
+    Per-serving kcal/carb/protein of a stored meal.
+
+    Catalog foods are stored by food_code and resolved against the
+    in-process nutrient matrix; recipes and older meals carry their
+    values inline.
+    """
+    code = meal.get("food_code")
+    if code:
+        macros = (matrix or get_nutrient_matrix()).macros(code)
+        if macros is not None:
+            return macros
+    return {
+        "kcal": float(meal.get("kcal") or 0),
+        "carb": float(meal.get("carb") or 0),
+        "protein": float(meal.get("protein") or 0)
+    }
+
+
+def day_totals(meals):
+    """Aggregate kcal/carb/protein over meal entries stored per serving."""
+    matrix = get_nutrient_matrix() if any("food_code" in meal for meal in meals) else None
+    kcal = carb = protein = 0.0
+    for meal in meals:
+        serving = float(meal.get("serving", 1))
+        macros = meal_macros(meal, matrix)
+        kcal += macros["kcal"] * serving
+        carb += macros["carb"] * serving
+        protein += macros["protein"] * serving
+    return {"kcal": round(kcal, 2), "carb": round(carb, 2), "protein": round(protein, 2)}
+
+
+def meal_entries(meals):
+    """Convert stored meals into the per-serving scaled rows the views use."""
+    matrix = get_nutrient_matrix() if any("food_code" in meal for meal in meals) else None
+    entries = []
+    for meal in meals:
+        serving = float(meal.get("serving", 1))
+        macros = meal_macros(meal, matrix)
+        entries.append({
+            "meal_id": meal.get("meal_id"),
+            "food_name": meal.get("food_name", ""),
+            "serving": serving,
+            "carbs": round(macros["carb"] * serving, 2),
+            "protein": round(macros["protein"] * serving, 2),
+            "kcal": round(macros["kcal"] * serving, 2)
+        })
+    return entries
+
+
+def nutrient_totals(meals):
+    """
+    Every catalog nutrient summed over a day's meals, per serving eaten.
+
+    Catalog meals go through one vectorized NutrientMatrix.totals call.
+    Meals without a known food_code only add their inline macros.
+    """
+    matrix = get_nutrient_matrix()
+    codes, servings = [], []
+    inline = {"energy_kcal": 0.0, "carb_g": 0.0, "protein_g": 0.0}
+    for meal in meals:
+        serving = float(meal.get("serving", 1))
+        code = meal.get("food_code")
+        if code in matrix:
+            codes.append(code)
+            servings.append(serving)
+        else:
+            inline["energy_kcal"] += float(meal.get("kcal") or 0) * serving
+            inline["carb_g"] += float(meal.get("carb") or 0) * serving
+            inline["protein_g"] += float(meal.get("protein") or 0) * serving
+    totals = matrix.totals(codes, servings)
+    for nutrient, value in inline.items():
+        totals[nutrient] += value
+    return {nutrient: round(value, 3) for nutrient, value in totals.items()}
+
+
+def split_day(day):
+    """Return (meals, totals) from a day dict; empty for a day with nothing logged."""
+    if not day:
+        return [], day_totals([])
+    meals = day.get("meals", [])
+    return meals, day.get("totals") or day_totals(meals)
+
+
+def _day_doc(date, meals):
+    return {
+        "date": date,
+        "meals": meals,
+        "totals": day_totals(meals),
+        "updated_at": dt.now().isoformat()
+    }
+
+
+@_transactional
+def _update_in_transaction(transaction, ref, date, edit):
+    snapshot = ref.get(transaction=transaction)
+    meals = snapshot.to_dict().get("meals", []) if snapshot.exists else []
+    result = edit(meals)
+    if meals:
+        transaction.set(ref, _day_doc(date, meals))
+    elif snapshot.exists:
+        transaction.delete(ref)
+    return result
+
+
+def update_day(db, user_id, date, edit):
+    """
+    Apply edit(meals) to a day's meal list inside a transaction.
+
+    `edit` mutates the list in place and may be retried on contention, so it
+    must not have side effects outside the list. Its return value is passed
+    through.
+    """
+    return _update_in_transaction(db.transaction(), day_ref(db, user_id, date), date, edit)
+
+
+@_transactional
+def _edit_days_in_transaction(transaction, db, refs, edits):
+    snapshots = {snap.id: snap for snap in db.get_all(refs, transaction=transaction)}
+    applied = []
+    for ref in refs:
+        date = ref.id
+        snapshot = snapshots.get(date)
+        if snapshot is None or not snapshot.exists:
+            continue
+        meals = snapshot.to_dict().get("meals", [])
+        by_id = {meal.get("meal_id"): meal for meal in meals}
+        changed = len(applied)
+        for meal_id, serving in edits[date]:
+            meal = by_id.get(meal_id)
+            if meal is None:
+                continue
+            if serving is None:
+                del by_id[meal_id]
+                meals.remove(meal)
+            else:
+                meal["serving"] = serving
+            applied.append({"date": date, "meal_id": meal_id, "serving": serving})
+        if len(applied) == changed:
+            continue
+        if meals:
+            transaction.set(ref, _day_doc(date, meals))
+        else:
+            transaction.delete(ref)
+    return applied
+
+
+def apply_meal_edits(db, user_id, edits):
+    """
+    Apply serving updates and deletions to one or more days.
+
+    `edits` maps date -> [(meal_id, serving)], where a serving of None
+    deletes the meal. Days are read and written in one transaction per
+    MAX_BATCH_WRITES days, so an edit of a single day is all-or-nothing.
+    Returns the edits that matched a stored meal.
+    """
+    from storage import MAX_BATCH_WRITES  # storage imports this module
+
+    dates = sorted(edits)
+    applied = []
+    for start in range(0, len(dates), MAX_BATCH_WRITES):
+        refs = [day_ref(db, user_id, date) for date in dates[start:start + MAX_BATCH_WRITES]]
+        applied += _edit_days_in_transaction(db.transaction(), db, refs, edits)
+    return applied
+
+
+def add_meals(db, user_id, date, new_meals):
+    """Append meals to a day and return their generated meal ids."""
+    for meal in new_meals:
+        meal.setdefault("meal_id", new_meal_id())
+
+    def edit(meals):
+        known = {meal.get("meal_id") for meal in meals}
+        meals.extend(meal for meal in new_meals if meal["meal_id"] not in known)
+
+    update_day(db, user_id, date, edit)
+    return [meal["meal_id"] for meal in new_meals]
+
+
+def add_meal(db, user_id, date, meal):
+    return add_meals(db, user_id, date, [meal])[0]
+
+
+@_transactional
+def _add_recipe_meal_in_transaction(transaction, db, ref, date, meal, recipe_ref, recipe):
+    # The recipe is only read when it may not exist yet (recipe is given)
+    refs = [ref, recipe_ref] if recipe is not None else [ref]
+    snapshots = {snap.reference.path: snap for snap in db.get_all(refs, transaction=transaction)}
+    day = snapshots.get(ref.path)
+    meals = day.to_dict().get("meals", []) if day is not None and day.exists else []
+    if meal["meal_id"] not in {m.get("meal_id") for m in meals}:
+        meals.append(meal)
+    transaction.set(ref, _day_doc(date, meals))
+
+    created = False
+    if recipe is not None:
+        existing = snapshots.get(recipe_ref.path)
+        if existing is None or not existing.exists:
+            transaction.set(recipe_ref, recipe)
+            created = True
+    counters.increment(transaction, recipe_ref, "times_used")
+    return created
+
+
+def add_recipe_meal(db, user_id, date, meal, recipe_ref, recipe=None):
+    """
+    Append a recipe meal, create the shared recipe if it is missing and
+    count the use, all in one transaction. Pass recipe=None when the recipe
+    is known to exist to skip reading it. Returns True if it was created.
+    """
+    meal.setdefault("meal_id", new_meal_id())
+    return _add_recipe_meal_in_transaction(
+        db.transaction(), db, day_ref(db, user_id, date), date, meal, recipe_ref, recipe
+    )
+
+
+@_transactional
+def _copy_legacy_in_transaction(transaction, db, ref, date, legacy_refs, delete_legacy):
+    # Legacy docs are re-read here, so a concurrent run sees this one's tombstones
+    snapshots = {snap.reference.path: snap for snap in db.get_all([ref] + legacy_refs, transaction=transaction)}
+    day = snapshots.get(ref.path)
+    meals = day.to_dict().get("meals", []) if day is not None and day.exists else []
+    known = {meal.get("meal_id") for meal in meals}
+    copied = []
+    for legacy_ref in legacy_refs:
+        snapshot = snapshots.get(legacy_ref.path)
+        if snapshot is None or not snapshot.exists:
+            continue
+        meal = snapshot.to_dict()
+        if not meal.pop(LEGACY_COPIED, False) and snapshot.id not in known:
+            meal["meal_id"] = snapshot.id
+            copied.append(meal)
+        if delete_legacy:
+            transaction.delete(legacy_ref)
+        else:
+            transaction.update(legacy_ref, {LEGACY_COPIED: True})
+    if copied:
+        copied.sort(key=lambda meal: meal.get("added_at") or meal.get("created_at") or "")
+        meals.extend(copied)
+        transaction.set(ref, _day_doc(date, meals))
+    return len(copied)
+
+
+def _retire_legacy(db, refs, delete_legacy):
+    from storage import MAX_BATCH_WRITES
+
+    for start in range(0, len(refs), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for ref in refs[start:start + MAX_BATCH_WRITES]:
+            if delete_legacy:
+                batch.delete(ref)
+            else:
+                batch.update(ref, {LEGACY_COPIED: True})
+        batch.commit()
+
+
+def migrate_user(db, user_id, delete_legacy=False):
+    """
+    Fold users/{user_id}/meals into per-day documents.
+
+    Each legacy doc is copied in the same transaction that tombstones it
+    (or deletes it with delete_legacy), so a re-run or a concurrent run
+    never copies it again and meals edited or deleted after migration stay
+    that way. Legacy docs of users migrated before tombstones existed were
+    already copied and are only tombstoned. Returns the number of days
+    written.
+    """
+    user_ref = db.collection("users").document(user_id)
+    user_snapshot = user_ref.get()
+    already_migrated = user_snapshot.exists and (user_snapshot.to_dict() or {}).get(MIGRATED_FLAG)
+
+    by_date = defaultdict(list)
+    retire = []
+    for meal_doc in user_ref.collection("meals").stream():
+        meal = meal_doc.to_dict()
+        if meal.get(LEGACY_COPIED):
+            if delete_legacy:
+                retire.append(meal_doc.reference)
+            continue
+        date = meal.get("date")
+        if not date:
+            continue
+        if already_migrated:
+            retire.append(meal_doc.reference)
+        else:
+            by_date[date].append(meal_doc.reference)
+
+    from storage import MAX_BATCH_WRITES
+
+    days = 0
+    chunk = MAX_BATCH_WRITES - 1  # one write goes to the day document
+    for date, refs in by_date.items():
+        copied = 0
+        for start in range(0, len(refs), chunk):
+            copied += _copy_legacy_in_transaction(
+                db.transaction(), db, day_ref(db, user_id, date), date, refs[start:start + chunk], delete_legacy
+            )
+        days += 1 if copied else 0
+
+    _retire_legacy(db, retire, delete_legacy)
+    user_ref.set({MIGRATED_FLAG: True}, merge=True)
+    return days
+
+
+def stream_range(db, user_id, start, end):
+    """Stream the day documents between two dates (inclusive) with one range query."""
+    days = db.collection("users").document(user_id).collection("days")
+    query = days.where("date", ">=", start).where("date", "<=", end)
+    for snapshot in query.stream():
+        yield snapshot.to_dict()
+
+
+def summarize_range(days, start, end, window=7):
+    """
+    Aggregate day documents into compact, chart-ready columns.
+
+    Returns per-day totals over every date in [start, end], a trailing
+    `window`-day average over logged days, and weekly (Monday-based) and
+    monthly rollups, all computed with array operations.
+    """
+    import numpy as np
+
+    dates = np.arange(np.datetime64(start), np.datetime64(end) + 1)
+    keys = ("kcal", "carb", "protein")
+    values = np.zeros((len(keys), len(dates)))
+    counts = np.zeros(len(dates), dtype=np.int64)
+
+    rows = [day for day in days if day.get("date")]
+    if rows:
+        index = (np.array([day["date"] for day in rows], dtype="datetime64[D]") - dates[0]).astype(np.int64)
+        inside = (index >= 0) & (index < len(dates))
+        totals = [day.get("totals") or day_totals(day.get("meals", [])) for day in rows]
+        for k, key in enumerate(keys):
+            column = np.array([float(t.get(key, 0)) for t in totals])
+            np.add.at(values[k], index[inside], column[inside])
+        meals = np.array([len(day.get("meals", [])) for day in rows])
+        np.add.at(counts, index[inside], meals[inside])
+
+    logged = (counts > 0).astype(np.float64)
+    kernel = np.ones(window)
+    rolling_sum = np.convolve(values[0], kernel)[:len(dates)]
+    rolling_days = np.convolve(logged, kernel)[:len(dates)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rolling_avg = rolling_sum / rolling_days
+
+    def rollup(groups, label):
+        unique, inverse = np.unique(groups, return_inverse=True)
+        days_logged = np.bincount(inverse, weights=logged, minlength=len(unique))
+        result = {label: [str(group) for group in unique]}
+        for k, key in enumerate(keys):
+            sums = np.bincount(inverse, weights=values[k], minlength=len(unique))
+            result[key] = _rounded(sums)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                result[f"{key}_avg"] = _rounded(sums / days_logged)
+        result["days_logged"] = days_logged.astype(int).tolist()
+        return result
+
+    weekday = (dates.astype(np.int64) - 4) % 7  # 1970-01-01 was a Thursday
+    week_starts = dates - weekday.astype("timedelta64[D]")
+    months = dates.astype("datetime64[M]")
+
+    return {
+        "start": str(dates[0]),
+        "end": str(dates[-1]),
+        "days": {
+            "date": [str(date) for date in dates],
+            **{key: _rounded(values[k]) for k, key in enumerate(keys)},
+            "meals": counts.tolist(),
+            f"kcal_avg_{window}d": _rounded(rolling_avg),
+        },
+        "weeks": rollup(week_starts, "start"),
+        "months": rollup(months, "month"),
+    }
+
+
+def _rounded(array):
+    """Round to two decimals, mapping NaN/inf to None for JSON."""
+    import numpy as np
+
+    return [round(float(v), 2) if np.isfinite(v) else None for v in array]
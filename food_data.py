@@ -1,20 +1,41 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+"""
+Import the food catalog into the Firestore food_data collection.
+
+Usage:
+    python food_data.py [--json food_data.json | --sqlite neutrino.db] [--workers 4] [--dry-run] [--report]
+
+Rows are streamed from the source, so the whole catalog is never held in
+memory. Each document stores a content_hash of its fields and rows whose
+hash already matches Firestore are skipped, so re-running the import only
+writes what changed. Writes go out in batches of at most 500 (Firestore's
+per-commit limit) committed in parallel, with retries on transient errors.
+
+--report compares the size of the search keyword encoding with the old
+every-prefix scheme over the source rows instead of importing.
+"""
+import argparse
+import hashlib
 import json
+import random
 import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-# Initialize Firebase
-cred = credentials.Certificate("serviceAccountKey.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+from catalog import CATALOG_DB, STOP_WORDS, connect, query_keywords, search_keywords, tokenize
+from storage import MAX_BATCH_WRITES, FirestoreStorage
+
+MAX_ATTEMPTS = 5
+READ_CHUNK = 64 * 1024  # bytes read from the JSON file at a time
 
-# Load JSON data
-with open('food_data.json', 'r') as f:
-    data = json.load(f)
 
 def generate_search_keywords(food_name):
+    """Bounded edge n-gram and word-pair keywords; see catalog.search_keywords."""
+    return search_keywords(food_name)
+
+
+def prefix_keywords(food_name):
     """
-    Generate simple search keywords:
+    The previous encoding, kept for --report:
     - Split words
     - Add prefixes for autocomplete
     """
@@ -29,22 +50,217 @@ def generate_search_keywords(food_name):
         for i in range(1, len(word) + 1):
             keywords.add(word[:i])
 
-    return list(keywords)
+    return sorted(keywords)
+
+
+def iter_json_array(path):
+    """Yield the objects of a top-level JSON array one at a time."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        position = 0
+        started = False
+        eof = False
+        while True:
+            # Skip whitespace and separators between items
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != "[":
+                    raise ValueError(f"{path} does not contain a JSON array")
+                started = True
+                position += 1
+                continue
+            if started and position < len(buffer) and buffer[position] == "]":
+                return
+            try:
+                if position >= len(buffer):
+                    raise ValueError("need more data")
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof:
+                    raise ValueError(f"{path} ended in the middle of the array")
+                chunk = f.read(READ_CHUNK)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            position = end
+            yield item
+
+
+def iter_sqlite(path=CATALOG_DB):
+    """Yield food_data rows from a SQLite catalog as dicts."""
+    conn = connect(path)
+    try:
+        cursor = conn.execute("SELECT * FROM food_data")
+        columns = [description[0] for description in cursor.description]
+        for row in cursor:
+            yield dict(zip(columns, row))
+    finally:
+        conn.close()
+
+
+def content_hash(doc):
+    encoded = json.dumps(doc, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def prepare(row):
+    """Return (food_code, document) for a source row."""
+    doc = dict(row)
+    food_code = str(doc.pop("food_code"))  # the code is the document id, not a field
+    doc["search_keywords"] = generate_search_keywords(doc.get("food_name") or "")
+    doc["content_hash"] = content_hash(doc)
+    return food_code, doc
+
+
+def existing_hashes(collection_ref):
+    """Map document id to its stored content_hash, reading only that field."""
+    return {
+        snapshot.id: (snapshot.to_dict() or {}).get("content_hash")
+        for snapshot in collection_ref.select(["content_hash"]).stream()
+    }
+
+
+def _is_transient(error):
+    from google.api_core import exceptions
+
+    return isinstance(error, (
+        exceptions.Aborted,
+        exceptions.DeadlineExceeded,
+        exceptions.InternalServerError,
+        exceptions.ServiceUnavailable,
+        exceptions.TooManyRequests,
+        exceptions.ResourceExhausted,
+    ))
+
+
+def commit_batch(db, collection_ref, docs):
+    """Write docs in one batch, retrying transient failures with backoff. Returns the count."""
+    for attempt in range(MAX_ATTEMPTS):
+        batch = db.batch()
+        for food_code, doc in docs:
+            batch.set(collection_ref.document(food_code), doc)
+        try:
+            batch.commit()
+            return len(docs)
+        except Exception as e:
+            if attempt + 1 == MAX_ATTEMPTS or not _is_transient(e):
+                raise
+            delay = 0.5 * 2 ** attempt + random.random() / 2
+            print(f"Batch of {len(docs)} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def import_catalog(db, rows, workers=4, dry_run=False):
+    """
+    Write changed rows to food_data and return counts of what happened.
+
+    At most 2 * workers batches are in flight at once, so memory stays
+    bounded however large the source is.
+    """
+    collection_ref = db.collection("food_data")
+    known = existing_hashes(collection_ref)
+    stats = {"rows": 0, "unchanged": 0, "written": 0, "failed": 0}
+    pending = set()
+
+    def collect(done):
+        for future in done:
+            try:
+                stats["written"] += future.result()
+            except Exception as e:
+                print(f"Batch failed: {e}")
+                stats["failed"] += future.batch_size
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        batch = []
+
+        def flush():
+            if dry_run:
+                stats["written"] += len(batch)
+                return
+            future = executor.submit(commit_batch, db, collection_ref, list(batch))
+            future.batch_size = len(batch)
+            pending.add(future)
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                pending.difference_update(done)
+                collect(done)
+
+        for row in rows:
+            stats["rows"] += 1
+            food_code, doc = prepare(row)
+            if known.get(food_code) == doc["content_hash"]:
+                stats["unchanged"] += 1
+                continue
+            batch.append((food_code, doc))
+            if len(batch) == MAX_BATCH_WRITES:
+                flush()
+                batch = []
+        if batch:
+            flush()
+        collect(wait(pending).done)
+    return stats
+
+
+def _entry_bytes(collection, doc_id, keyword):
+    # Estimated per Firestore's storage size rules: document name, field
+    # name and value, plus 32 bytes of overhead per index entry
+    name_size = len(collection.encode()) + 1 + len(doc_id.encode()) + 1 + 16
+    return name_size + len("search_keywords") + 1 + len(keyword.encode()) + 1 + 32
+
+
+def keyword_report(rows):
+    """Compare stored keywords and index entries of the two encodings."""
+    schemes = {"prefixes": prefix_keywords, "edge_ngrams": generate_search_keywords}
+    report = {name: {"docs": 0, "entries": 0, "max_per_doc": 0, "keyword_bytes": 0, "index_bytes_est": 0}
+              for name in schemes}
+    unsearchable = []  # words of a name that a query for just that word would not find
+    for row in rows:
+        food_code = str(row.get("food_code"))
+        food_name = row.get("food_name") or ""
+        stored = set(generate_search_keywords(food_name))
+        for word in dict.fromkeys(tokenize(food_name)):
+            if word not in STOP_WORDS and query_keywords(word) and not stored.intersection(query_keywords(word)):
+                unsearchable.append(f"{food_name}: {word}")
+        for name, encode in schemes.items():
+            keywords = encode(food_name)
+            stats = report[name]
+            stats["docs"] += 1
+            stats["entries"] += len(keywords)
+            stats["max_per_doc"] = max(stats["max_per_doc"], len(keywords))
+            stats["keyword_bytes"] += sum(len(keyword.encode()) + 1 for keyword in keywords)
+            stats["index_bytes_est"] += sum(_entry_bytes("food_data", food_code, k) for k in keywords)
+    old, new = report["prefixes"], report["edge_ngrams"]
+    new["unsearchable_words"] = unsearchable
+    report["change"] = {
+        key: f"{(new[key] - old[key]) / old[key]:+.1%}" for key in ("entries", "keyword_bytes", "index_bytes_est")
+    }
+    return report
+
 
-# Create batch
-batch = db.batch()
-collection_ref = db.collection('food_data')
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--json", default="food_data.json", help="JSON array of food rows (default)")
+    source.add_argument("--sqlite", nargs="?", const=CATALOG_DB, help="read the food_data table of this database")
+    parser.add_argument("--workers", type=int, default=4, help="batches committed in parallel")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be written without writing")
+    parser.add_argument("--report", action="store_true", help="compare keyword encodings and exit")
+    args = parser.parse_args()
 
-for doc in data:
-    food_code = doc.pop('food_code')  # Remove food_code from doc
+    rows = iter_sqlite(args.sqlite) if args.sqlite else iter_json_array(args.json)
+    if args.report:
+        print(json.dumps(keyword_report(rows), indent=2))
+        return
 
-    # Generate search keywords
-    food_name = doc.get('food_name', '')
-    doc['search_keywords'] = generate_search_keywords(food_name)
+    stats = import_catalog(FirestoreStorage().db, rows, workers=args.workers, dry_run=args.dry_run)
+    print(
+        f"{stats['rows']} rows: {stats['written']} {'to write' if args.dry_run else 'written'}, "
+        f"{stats['unchanged']} unchanged, {stats['failed']} failed"
+    )
 
-    doc_ref = collection_ref.document(food_code)
-    batch.set(doc_ref, doc)
 
-# Commit batch
-batch.commit()
-print("Data imported successfully with search keywords!")
+if __name__ == "__main__":
+    main()
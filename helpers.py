@@ -1,3 +1,8 @@
+import getpass
+import os
+import stat
+import tempfile
+
 from flask import redirect, render_template, session
 from functools import wraps
 
@@ -41,3 +46,23 @@ def login_required(f):
         return f(*args, **kwargs)
 
     return decorated_function
+
+
+def private_dir(path=None):
+    """
+    Return a directory only the current OS user can read or write, creating it if needed.
+
+    Local caches go here so other users on the host can neither read them
+    nor plant entries. Defaults to a per-user directory in the temp dir; an
+    existing directory must be owned by this user with mode 0700.
+    """
+    if path is None:
+        owner = os.getuid() if hasattr(os, "getuid") else getpass.getuser()
+        path = os.path.join(tempfile.gettempdir(), f"nutrino-{owner}")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"{path} is not a directory")
+    if hasattr(os, "getuid") and (info.st_uid != os.getuid() or info.st_mode & 0o077):
+        raise PermissionError(f"{path} must be owned by the current user with mode 0700")
+    return path
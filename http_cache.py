@@ -0,0 +1,144 @@
+"""
+Per-route HTTP caching and response compression.
+
+Every response is private and uncacheable unless its view is tagged with
+@cache_policy. "catalog" responses (food lookups, autocomplete, nutrient
+queries) are the same for every user, so browsers may keep them briefly
+and revalidate with a weak ETag, getting a 304 when nothing changed. Static
+files linked with a content fingerprint (?v=<hash>) never change under the
+same URL and are cached for a year, as are "immutable" responses such
+as versioned catalog snapshots.
+
+HTML, JSON and plain-text bodies are compressed with brotli when the
+`brotli` package is installed and the client accepts it, gzip otherwise.
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CATALOG_MAX_AGE = int(os.environ.get("CATALOG_MAX_AGE", 300))  # seconds
+STATIC_MAX_AGE = 365 * 24 * 3600  # fingerprinted URLs change with the file
+
+POLICIES = {
+    # Per-user pages and anything that writes
+    "private": "private, no-store",
+    # Catalog data behind login: browsers may reuse it, shared caches may not
+    "catalog": f"private, max-age={CATALOG_MAX_AGE}",
+    # Small catalog metadata that must be current: always revalidate
+    "revalidate": "private, no-cache",
+    # Content-addressed responses (catalog snapshots), the same for everyone
+    "immutable": f"public, max-age={STATIC_MAX_AGE}, immutable",
+    "static": f"public, max-age={STATIC_MAX_AGE}, immutable",
+    # Static files requested without (or with a stale) fingerprint
+    "static_unversioned": "public, max-age=3600",
+}
+ETAG_POLICIES = {"catalog", "revalidate"}
+
+COMPRESSIBLE = {"text/html", "application/json", "text/plain", "text/css", "application/javascript"}
+MIN_COMPRESS_BYTES = 500  # smaller bodies gain less than the header costs
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # dynamic responses: fast, still smaller than gzip
+
+_fingerprints = {}  # path -> (mtime, digest)
+_fingerprint_lock = threading.Lock()
+
+
+def cache_policy(name):
+    """Tag a view with a policy from POLICIES; place it right under @app.route."""
+    if name not in POLICIES:
+        raise ValueError(f"Unknown cache policy: {name}")
+
+    def decorator(view):
+        view.cache_policy = name
+        return view
+
+    return decorator
+
+
+def fingerprint(path):
+    """Short content hash of a file, recomputed only when its mtime changes."""
+    mtime = os.path.getmtime(path)
+    with _fingerprint_lock:
+        cached = _fingerprints.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    with _fingerprint_lock:
+        _fingerprints[path] = (mtime, digest)
+    return digest
+
+
+def _policy(view, static_folder):
+    if request.method not in ("GET", "HEAD"):
+        return "private"
+    if request.endpoint == "static":
+        filename = (request.view_args or {}).get("filename", "")
+        try:
+            current = fingerprint(os.path.join(static_folder, filename))
+        except OSError:
+            return "static_unversioned"
+        return "static" if request.args.get("v") == current else "static_unversioned"
+    return getattr(view, "cache_policy", "private")
+
+
+def _encoding():
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(offered)
+
+
+def compress(response):
+    """Compress a buffered text response in place if the client accepts it."""
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = _encoding()
+    if not encoding:
+        return response
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_BYTES:
+        return response
+    if encoding == "br":
+        body = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        body = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # The compressed bytes differ, so the tag can only be a weak match
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def apply(response, view, static_folder):
+    """Set Cache-Control (and ETag/304 where allowed) for the view that answered."""
+    policy = _policy(view, static_folder)
+    if response.status_code not in (200, 304):
+        policy = "private"
+
+    if policy == "private":
+        response.headers["Cache-Control"] = POLICIES["private"]
+        response.headers["Expires"] = 0
+        response.headers["Pragma"] = "no-cache"
+        return compress(response)
+
+    response.headers["Cache-Control"] = POLICIES[policy]
+    if policy in ETAG_POLICIES and response.status_code == 200 and not response.is_streamed:
+        response.add_etag(weak=True)
+        response.make_conditional(request)
+    return compress(response)
@@ -0,0 +1,110 @@
+"""
+Bounded background job queue for slow calls such as recipe generation.
+
+Jobs run on a small dedicated thread pool so they cannot take over the
+WSGI worker threads. Submissions are rejected with QueueFull when the
+queue is too deep or the user already has too many jobs in flight, and
+jobs that waited in the queue past their deadline are dropped instead of
+being run late. Job state is kept in this process only.
+"""
+import contextvars
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache
+
+
+class QueueFull(Exception):
+    """Raised when a job cannot be accepted right now."""
+
+
+class Job:
+    def __init__(self, user_id, timeout):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.deadline = self.created_at + timeout
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the job finishes or timeout passes; returns whether it finished."""
+        return self._done.wait(timeout)
+
+    def _finish(self, status, result=None, error=None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self._done.set()
+
+    def to_dict(self):
+        data = {"job_id": self.id, "status": self.status}
+        if self.status == "done":
+            data["result"] = self.result
+        elif self.error:
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    """Runs jobs with global and per-user concurrency caps and queue-depth back-pressure."""
+
+    def __init__(self, max_workers=4, max_pending=16, per_user=2, timeout=60, result_ttl=600):
+        self.max_pending = max_pending
+        self.per_user = per_user
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="jobs")
+        self._jobs = TTLCache(max_entries=1024, ttl=result_ttl)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._per_user = {}
+
+    def submit(self, user_id, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) for user_id and return its Job."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull("Too many requests are waiting, please try again shortly")
+            if self._per_user.get(user_id, 0) >= self.per_user:
+                raise QueueFull("You already have a recipe being generated")
+            self._pending += 1
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+
+        job = Job(user_id, self.timeout)
+        self._jobs.set(job.id, job)
+        self._executor.submit(contextvars.copy_context().run, self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs):
+        with self._lock:
+            self._pending -= 1
+        try:
+            if time.time() > job.deadline:
+                job._finish("timeout", error="Timed out waiting in the queue")
+                return
+            job.status = "running"
+            job._finish("done", result=fn(*args, **kwargs))
+        except Exception as e:
+            print(f"Job {job.id} error: {e}")
+            job._finish("error", error=str(e) or "Job failed")
+        finally:
+            with self._lock:
+                remaining = self._per_user.get(job.user_id, 1) - 1
+                if remaining > 0:
+                    self._per_user[job.user_id] = remaining
+                else:
+                    self._per_user.pop(job.user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"pending": self._pending, "active_users": len(self._per_user)}
@@ -0,0 +1,54 @@
+"""
+Request-scoped storage read deduplication.
+
+Each request gets a DataLoader on flask.g that memoizes reads by key.
+Reads are issued on a shared thread pool, so independent documents can be
+fetched concurrently and awaited later.
+"""
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g
+
+READ_WORKERS = 16
+
+executor = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="storage-read")
+
+
+def submit(fn, *args):
+    """Run fn(*args) on the read pool inside a copy of the caller's context."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+class DataLoader:
+    """Memoizes storage reads for the life of one request."""
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def prefetch(self, key, fn, *args):
+        """Start fn(*args) in the background unless key was already requested."""
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None:
+                future = submit(fn, *args)
+                self._futures[key] = future
+            return future
+
+    def get(self, key, fn, *args):
+        """Return the result of fn(*args), running it at most once per request for key."""
+        return self.prefetch(key, fn, *args).result()
+
+    def forget(self, key):
+        """Drop a memoized read, e.g. after writing the data behind it."""
+        with self._lock:
+            self._futures.pop(key, None)
+
+
+def get_loader():
+    """Return the DataLoader for the current request."""
+    if "loader" not in g:
+        g.loader = DataLoader()
+    return g.loader
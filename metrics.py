@@ -0,0 +1,242 @@
+"""
+Per-request instrumentation and Prometheus metrics.
+
+Storage calls, Gemini calls, password hashing and cache lookups are recorded with timed()
+and record_cache(). Each record goes to two places: the current request's
+RequestStats, which becomes the Server-Timing header, and a process-wide
+registry that /metrics renders in the Prometheus text format. The request
+is tracked in a ContextVar, so work submitted with loader.submit() or
+the job queue is attributed to the request that started it.
+"""
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from collections import defaultdict
+
+# Seconds; roughly Prometheus' defaults, with finer steps at the low end
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Registry:
+    """Process-wide counters and histograms keyed by label tuples."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(Histogram)    # (route, method, status) -> latency
+        self.operations = defaultdict(Histogram)  # (route, kind, op) -> latency
+        self.cache = defaultdict(int)             # (route, cache, result) -> count
+
+    def observe_request(self, route, method, status, seconds):
+        with self._lock:
+            self.requests[(route, method, str(status))].observe(seconds)
+
+    def observe_operation(self, route, kind, op, seconds):
+        with self._lock:
+            self.operations[(route, kind, op)].observe(seconds)
+
+    def count_cache(self, route, cache, hit):
+        with self._lock:
+            self.cache[(route, cache, "hit" if hit else "miss")] += 1
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            _render_histograms(
+                lines, "nutrino_request_duration_seconds", "HTTP request latency by route",
+                ("route", "method", "status"), self.requests
+            )
+            _render_histograms(
+                lines, "nutrino_operation_duration_seconds",
+                "Storage and Gemini call latency by route (kind=storage_read|storage_write|gemini|password_hash)",
+                ("route", "kind", "op"), self.operations
+            )
+            lines.append("# HELP nutrino_cache_lookups_total Cache lookups by route and result")
+            lines.append("# TYPE nutrino_cache_lookups_total counter")
+            for labels, count in sorted(self.cache.items()):
+                lines.append(f"nutrino_cache_lookups_total{{{_labels(('route', 'cache', 'result'), labels)}}} {count}")
+
+            ratios = defaultdict(lambda: [0, 0])
+            for (route, cache, result), count in self.cache.items():
+                ratios[cache][0 if result == "hit" else 1] += count
+            lines.append("# HELP nutrino_cache_hit_ratio Share of cache lookups that hit, across all routes")
+            lines.append("# TYPE nutrino_cache_hit_ratio gauge")
+            for cache, (hits, misses) in sorted(ratios.items()):
+                lines.append(f"nutrino_cache_hit_ratio{{{_labels(('cache',), (cache,))}}} {hits / (hits + misses):.6f}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _render_histograms(lines, name, help_text, label_names, histograms):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, histogram in sorted(histograms.items()):
+        base = _labels(label_names, labels)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{base},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{base},le="+Inf"}} {histogram.count}')
+        lines.append(f"{name}_sum{{{base}}} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{{{base}}} {histogram.count}")
+
+
+registry = Registry()
+
+
+class RequestStats:
+    """Count and total time per kind of operation within one request."""
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.operations = defaultdict(lambda: [0, 0.0])  # kind -> [count, seconds]
+        self.cache = defaultdict(lambda: [0, 0])         # cache -> [hits, misses]
+
+    def add(self, kind, seconds):
+        with self._lock:
+            entry = self.operations[kind]
+            entry[0] += 1
+            entry[1] += seconds
+
+    def add_cache(self, cache, hit):
+        with self._lock:
+            self.cache[cache][0 if hit else 1] += 1
+
+    def server_timing(self):
+        """Format the Server-Timing header value for this request."""
+        parts = []
+        with self._lock:
+            for kind, (count, seconds) in sorted(self.operations.items()):
+                parts.append(f'{kind};dur={seconds * 1000:.1f};desc="{count} call{"s" if count != 1 else ""}"')
+            for cache, (hits, misses) in sorted(self.cache.items()):
+                parts.append(f'cache-{cache};desc="{hits} hit, {misses} miss"')
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def start_request(route):
+    """Begin tracking a request in the current context and return its stats."""
+    stats = RequestStats(route)
+    _current.set(stats)
+    return stats
+
+
+def current():
+    """Return the RequestStats for the request being handled, or None."""
+    return _current.get()
+
+
+def current_route():
+    stats = _current.get()
+    return stats.route if stats else "background"
+
+
+def _record(kind, op, seconds):
+    stats = _current.get()
+    if stats is not None:
+        stats.add(kind, seconds)
+    registry.observe_operation(current_route(), kind, op, seconds)
+
+
+class timed:
+    """Context manager that records one operation: `with timed("gemini", "generate_content"):`"""
+
+    def __init__(self, kind, op):
+        self.kind = kind
+        self.op = op
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.kind, self.op, time.perf_counter() - self.start)
+        return False
+
+
+def record_cache(cache, hit):
+    """Count one cache lookup for the current request and route."""
+    stats = _current.get()
+    if stats is not None:
+        stats.add_cache(cache, hit)
+    registry.count_cache(current_route(), cache, hit)
+
+
+def _timed_generator(generator, kind, op, elapsed):
+    # Time spent between items belongs to the caller, so only count next()
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                return
+            elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        _record(kind, op, elapsed)
+
+
+class Instrumented:
+    """
+    Proxy that times every public method call on a backend object.
+
+    `kinds` maps a method name to its kind (e.g. "storage_write"); other
+    methods use `default_kind`. Generators are timed until exhausted.
+    """
+
+    def __init__(self, target, default_kind, kinds=None):
+        self._target = target
+        self._default_kind = default_kind
+        self._kinds = kinds or {}
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        kind = self._kinds.get(name, self._default_kind)
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                _record(kind, name, time.perf_counter() - start)
+                raise
+            if inspect.isgenerator(result):
+                return _timed_generator(result, kind, name, time.perf_counter() - start)
+            _record(kind, name, time.perf_counter() - start)
+            return result
+
+        return call
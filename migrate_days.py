@@ -0,0 +1,39 @@
+"""
+Convert users/{id}/meals subcollections into per-day documents.
+
+Usage:
+    python migrate_days.py [--user USERNAME] [--force] [--delete-legacy]
+"""
+import argparse
+
+from daylog import MIGRATED_FLAG, migrate_user
+from storage import FirestoreStorage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--user", help="only migrate this user")
+    parser.add_argument("--force", action="store_true", help="re-run for users already migrated (tombstones or deletes leftover legacy docs)")
+    parser.add_argument("--delete-legacy", action="store_true", help="delete meals docs after copying")
+    args = parser.parse_args()
+
+    db = FirestoreStorage().db
+
+    if args.user:
+        users = [db.collection("users").document(args.user).get()]
+    else:
+        users = db.collection("users").stream()
+
+    for user_doc in users:
+        if not user_doc.exists:
+            print(f"{user_doc.id}: not found")
+            continue
+        if user_doc.to_dict().get(MIGRATED_FLAG) and not args.force:
+            print(f"{user_doc.id}: already migrated")
+            continue
+        days = migrate_user(db, user_doc.id, delete_legacy=args.delete_legacy)
+        print(f"{user_doc.id}: {days} days")
+
+
+if __name__ == "__main__":
+    main()
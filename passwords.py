@@ -0,0 +1,93 @@
+"""
+Password hashing on a bounded process pool.
+
+scrypt and PBKDF2 are deliberately slow and hold the GIL while they run,
+so hashing inline lets a burst of logins stall every other request in the
+worker. Hashes are computed in a small pool of separate processes instead.
+Calls beyond the pool's capacity plus MAX_PENDING waiting ones are
+rejected with QueueFull so the caller can answer 503 straight away. Where
+processes cannot be started (some serverless runtimes), or with
+PASSWORD_HASH_WORKERS=0, hashing runs inline under the same limit.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from jobs import QueueFull
+import metrics
+
+# Parameters for new hashes; stored hashes with other parameters are
+# replaced on the next successful login
+HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 32))
+HASH_TIMEOUT = 10  # seconds
+
+_pool = None
+_pool_failed = False
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(HASH_WORKERS, 1) + MAX_PENDING)
+
+
+def _get_pool():
+    """The process pool, started on first use, or None to hash inline."""
+    global _pool, _pool_failed
+    if _pool is None and not _pool_failed and HASH_WORKERS > 0:
+        with _pool_lock:
+            if _pool is None and not _pool_failed:
+                try:
+                    # spawn, not fork: children must not inherit gRPC and thread state
+                    _pool = ProcessPoolExecutor(
+                        max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                    )
+                except (OSError, NotImplementedError, ImportError) as e:
+                    print(f"Password hash pool unavailable, hashing inline: {e}")
+                    _pool_failed = True
+    return _pool
+
+
+def _discard_pool(pool):
+    """Drop a pool whose worker died so the next call starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _run(op, fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise QueueFull("Too many sign-ins at once, please try again shortly")
+    try:
+        with metrics.timed("password_hash", op):
+            pool = _get_pool()
+            if pool is None:
+                return fn(*args)
+            try:
+                return pool.submit(fn, *args).result(timeout=HASH_TIMEOUT)
+            except BrokenProcessPool:
+                _discard_pool(pool)
+                raise
+    finally:
+        _slots.release()
+
+
+def hash_password(password):
+    """Hash a password with HASH_METHOD off the request thread."""
+    return _run("hash", generate_password_hash, password, HASH_METHOD)
+
+
+def verify_password(stored_hash, password):
+    """Check a password against a stored hash off the request thread."""
+    if not stored_hash:
+        return False
+    return _run("verify", check_password_hash, stored_hash, password)
+
+
+def needs_rehash(stored_hash):
+    """Whether a stored hash was made with parameters other than HASH_METHOD."""
+    return bool(stored_hash) and stored_hash.split("$", 1)[0] != HASH_METHOD
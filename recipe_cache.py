@@ -0,0 +1,129 @@
+"""
+Persistent cache of Gemini recipe generations.
+
+Entries live in a local SQLite file, by default in a directory private
+to the current user (see helpers.private_dir), and are keyed on a hash of the
+normalized prompt inputs, so re-submitting the same ingredients for the
+same meal and a similar calorie budget skips the model call.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from helpers import private_dir
+
+RECIPE_CACHE_PATH = os.environ.get("RECIPE_CACHE_PATH")  # None: recipe_cache.db in private_dir()
+RECIPE_CACHE_TTL = int(os.environ.get("RECIPE_CACHE_TTL", 7 * 24 * 3600))  # seconds
+RECIPE_CACHE_MAX_ENTRIES = int(os.environ.get("RECIPE_CACHE_MAX_ENTRIES", 5000))
+CALORIE_BUCKET = int(os.environ.get("RECIPE_CACHE_CALORIE_BUCKET", 100))  # kcal
+
+# Bump when the prompt or parser output changes so old entries stop matching
+PROMPT_VERSION = 2
+
+_split_re = re.compile(r"[,;\n]+")
+_space_re = re.compile(r"\s+")
+
+
+def normalize_ingredients(ingredients):
+    """Return the ingredient list as a sorted, lowercased, de-duplicated tuple."""
+    items = (_space_re.sub(" ", item).strip().lower() for item in _split_re.split(ingredients or ""))
+    return tuple(sorted({item for item in items if item}))
+
+
+def cache_key(ingredients, time_of_day, remaining_calories, model):
+    """Content address for a generation request."""
+    payload = {
+        "v": PROMPT_VERSION,
+        "model": model,
+        "ingredients": normalize_ingredients(ingredients),
+        "time_of_day": (time_of_day or "").strip().lower(),
+        "calories": int(float(remaining_calories) // CALORIE_BUCKET),
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class RecipeCache:
+    """SQLite-backed store of raw and parsed recipe responses with TTL and size cap."""
+
+    def __init__(self, path=RECIPE_CACHE_PATH, ttl=RECIPE_CACHE_TTL, max_entries=RECIPE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.path is None:
+                self.path = os.path.join(private_dir(), "recipe_cache.db")
+            else:
+                # A configured file needs a private directory just like the default
+                private_dir(os.path.dirname(os.path.abspath(self.path)))
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS recipe_cache ("
+                        "key TEXT PRIMARY KEY, raw_text TEXT NOT NULL, parsed TEXT NOT NULL, "
+                        "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                    )
+                    conn.execute(
+                        "CREATE INDEX IF NOT EXISTS recipe_cache_accessed ON recipe_cache (accessed_at)"
+                    )
+                    conn.commit()
+                    self._initialized = True
+        return conn
+
+    def get(self, key):
+        """Return (raw_text, parsed) for a fresh entry, or None."""
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT raw_text, parsed, created_at FROM recipe_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            raw_text, parsed, created_at = row
+            now = time.time()
+            if self.ttl and now - created_at > self.ttl:
+                conn.execute("DELETE FROM recipe_cache WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE recipe_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return raw_text, json.loads(parsed)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print(f"Recipe cache read error: {e}")
+            return None
+
+    def set(self, key, raw_text, parsed):
+        """Store a generation, evicting least recently used entries over the cap."""
+        try:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO recipe_cache (key, raw_text, parsed, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, raw_text, json.dumps(parsed), now, now),
+            )
+            if self.ttl:
+                conn.execute("DELETE FROM recipe_cache WHERE created_at < ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM recipe_cache WHERE key IN ("
+                "SELECT key FROM recipe_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            print(f"Recipe cache write error: {e}")
@@ -0,0 +1,231 @@
+"""
+Parsing of Gemini recipe output.
+
+Blocking generations ask for JSON matching RECIPE_SCHEMA and need no
+parsing beyond json.loads. Streamed generations, and any reply that is
+not valid JSON, use the free-text format with sections marked
+**Recipe Name:**, **Ingredients:**, **Steps:** and **Nutrition:**.
+parse_recipe_text reads a complete reply in one pass, and
+RecipeStreamParser consumes the text as it arrives and emits each section
+as soon as the next one starts, so the browser can render the name and
+ingredients while steps are still being generated. Every path returns
+the same dict shape.
+"""
+import json
+import re
+
+SECTIONS = (
+    ("name", "**Recipe Name:**"),
+    ("ingredients", "**Ingredients:**"),
+    ("steps", "**Steps:**"),
+    ("nutrition", "**Nutrition:**"),
+)
+
+RECIPE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string", "description": "General, guessable name of at most 3 words"},
+        "ingredients": {"type": "array", "items": {"type": "string"}},
+        "steps": {"type": "array", "items": {"type": "string"}},
+        "calories": {"type": "number"},
+        "protein": {"type": "number", "description": "grams"},
+        "carbs": {"type": "number", "description": "grams"},
+    },
+    "required": ["name", "ingredients", "steps", "calories", "protein", "carbs"],
+}
+
+# Lookahead so overlapping markers like "**Ingredients:***Steps:**" are all
+# found, as RecipeStreamParser's str.find does
+_marker_re = re.compile(r"(?=\*\*(Recipe Name|Ingredients|Steps|Nutrition):\*\*)")
+_marker_sections = {marker[2:-3]: section for section, marker in SECTIONS}
+_bullet_re = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+# A bullet inside a line needs whitespace on both sides, so "low-fat" stays whole
+_inline_bullet_re = re.compile(r"(?:^|\s)[-*•]\s+")
+# Steps are numbered at line starts, so "Preheat to 180. Then add oil." stays
+# one step; a one-line section is split only at the next step's number
+_step_split_re = re.compile(r"^\s*\d+[.)]\s+", re.MULTILINE)
+_inline_step_re = re.compile(r"(?:^|\s)(\d+)[.)]\s+")
+_fence_re = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+_leading_number_re = re.compile(r"-?\d+(?:\.\d+)?")
+_number_re = {
+    "calories": re.compile(r"Calories:\s*([\d.]+)", re.IGNORECASE),
+    "protein": re.compile(r"Protein:\s*([\d.]+)", re.IGNORECASE),
+    "carbs": re.compile(r"Carbs:\s*([\d.]+)", re.IGNORECASE),
+}
+
+
+def _parse_name(text):
+    lines = text.split("**", 1)[0].strip().splitlines()
+    return lines[0].strip() if lines else ""
+
+
+def _parse_ingredients(text):
+    lines = [line for line in text.splitlines() if line.strip()]
+    if len(lines) == 1:
+        # Inline list: "- rice - low-fat milk - sugar"
+        candidates = _inline_bullet_re.split(lines[0])
+    else:
+        candidates = [_bullet_re.sub("", line, count=1) for line in lines]
+    items = []
+    for candidate in candidates:
+        item = candidate.strip()
+        if item and not item.startswith("**"):
+            items.append(item)
+    return items
+
+
+def _parse_steps(text):
+    # Splitting the whole section joins continuation lines into their step
+    lines = [line for line in text.splitlines() if line.strip()]
+    if len(lines) == 1:
+        parts, start, expected = [], 0, 1
+        for match in _inline_step_re.finditer(lines[0]):
+            if int(match.group(1)) == expected:
+                parts.append(lines[0][start:match.start()])
+                start, expected = match.end(), expected + 1
+        parts.append(lines[0][start:])
+    else:
+        parts = _step_split_re.split("\n".join(lines))
+    return [" ".join(part.split()) for part in parts[1:] if part.strip()]
+
+
+def _parse_nutrition(text):
+    values = {}
+    for key, pattern in _number_re.items():
+        match = pattern.search(text)
+        if match:
+            try:
+                values[key] = float(match.group(1).rstrip("."))
+            except ValueError:
+                pass
+    return values
+
+
+_PARSERS = {
+    "name": _parse_name,
+    "ingredients": _parse_ingredients,
+    "steps": _parse_steps,
+    "nutrition": _parse_nutrition,
+}
+
+
+def _empty_recipe(raw_text):
+    return {
+        "name": "",
+        "ingredients": [],
+        "steps": [],
+        "calories": 0,
+        "protein": 0,
+        "carbs": 0,
+        "raw_content": raw_text,
+    }
+
+
+def parse_recipe_text(text):
+    """Parse a complete free-text reply with a single scan for section markers."""
+    recipe = _empty_recipe(text)
+    found = []
+    for match in _marker_re.finditer(text):
+        section = _marker_sections[match.group(1)]
+        if all(section != seen for seen, _, _ in found):
+            found.append((section, match.start(), match.start() + len(match.group(1)) + 5))
+    found.sort(key=lambda item: item[1])
+    for i, (section, _, content) in enumerate(found):
+        end = found[i + 1][1] if i + 1 < len(found) else len(text)
+        value = _PARSERS[section](text[content:end])
+        if section == "nutrition":
+            recipe.update(value)
+        else:
+            recipe[section] = value
+    return recipe
+
+
+def _number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = _leading_number_re.search(str(value or ""))
+    return float(match.group()) if match else 0
+
+
+def parse_recipe_json(text):
+    """Parse a reply produced against RECIPE_SCHEMA; returns None if it is not usable."""
+    try:
+        data = json.loads(_fence_re.sub("", text))
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("name"), str):
+        return None
+    recipe = _empty_recipe(text)
+    recipe["name"] = data["name"].strip()
+    for key in ("ingredients", "steps"):
+        values = data.get(key)
+        if isinstance(values, list):
+            recipe[key] = [str(value).strip() for value in values if str(value).strip()]
+    for key in ("calories", "protein", "carbs"):
+        recipe[key] = _number(data.get(key))
+    return recipe
+
+
+def parse_recipe_response(text):
+    """Parse a Gemini recipe reply, JSON or free text, into structured data."""
+    try:
+        text = text or ""
+        if text.lstrip().startswith(("{", "```")):
+            recipe = parse_recipe_json(text)
+            if recipe is not None:
+                return recipe
+        return parse_recipe_text(text)
+    except Exception as e:
+        print(f"Error parsing recipe: {e}")
+        return None
+
+
+class RecipeStreamParser:
+    """Accumulates streamed text and reports each recipe section once complete."""
+
+    def __init__(self):
+        self.text = ""
+        self._starts = {}
+        self._emitted = set()
+
+    def feed(self, chunk):
+        """Add a chunk of model output and return newly completed sections."""
+        self.text += chunk or ""
+        for section, marker in SECTIONS:
+            if section not in self._starts:
+                # Re-scan a little before the new chunk in case a marker was split
+                position = self.text.find(marker, max(0, len(self.text) - len(chunk or "") - len(marker)))
+                if position != -1:
+                    self._starts[section] = (position, position + len(marker))
+        return self._collect(final=False)
+
+    def finish(self):
+        """Return every section not yet emitted, treating the text as complete."""
+        return self._collect(final=True)
+
+    def _collect(self, final):
+        events = []
+        found = sorted((start, content, section) for section, (start, content) in self._starts.items())
+        for i, (start, content, section) in enumerate(found):
+            if section in self._emitted:
+                continue
+            if i + 1 < len(found):
+                end = found[i + 1][0]
+            elif final:
+                end = len(self.text)
+            elif section == "name":
+                # The name is a single line, so it is complete at its newline
+                rest = self.text[content:]
+                end = self.text.find("\n", content + len(rest) - len(rest.lstrip()))
+                if end == -1 or not rest.strip():
+                    continue
+            else:
+                continue
+            self._emitted.add(section)
+            events.append((section, _PARSERS[section](self.text[content:end])))
+        return events
+
+
+def sse(event, data):
+    """Format one Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
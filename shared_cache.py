@@ -0,0 +1,283 @@
+"""
+Cache tier shared by the workers on one host, behind the per-process TTLCache.
+
+Lookups try the worker's own TTLCache first, then the shared backend, and
+a shared hit is copied into the local cache. Writes go to both. Deletes
+remove the key from both and append it to an invalidation log in the
+backend. Every worker reads that log at most every SYNC_INTERVAL seconds
+and drops the listed keys locally, so a write made through one worker
+is seen by all others within that time.
+
+SHARED_CACHE_URL picks the backend:
+- a SQLite file path, or sqlite:///path, in a directory private to the
+  current user (by default shared_cache.db in helpers.private_dir())
+- redis://host:port/db for a Redis-protocol server (needs the `redis` package)
+- none to keep caches per process
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from helpers import private_dir
+import metrics
+
+SHARED_CACHE_URL = os.environ.get("SHARED_CACHE_URL")  # None: shared_cache.db in private_dir()
+SYNC_INTERVAL = float(os.environ.get("SHARED_CACHE_SYNC_INTERVAL", 0.5))  # seconds
+INVALIDATION_RETENTION = 3600  # seconds an invalidation stays in the log
+PRUNE_EVERY = 500  # writes between sweeps of expired rows
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), default=str)
+
+
+class SQLiteBackend:
+    """Entries and invalidation log in a WAL-mode SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._writes = 0
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS cache_entries ("
+                        "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                        "expires_at REAL, PRIMARY KEY (namespace, key))"
+                    )
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS cache_invalidations ("
+                        "seq INTEGER PRIMARY KEY AUTOINCREMENT, namespace TEXT NOT NULL, "
+                        "key TEXT, created_at REAL NOT NULL)"
+                    )
+                    conn.commit()
+                    self._initialized = True
+        return conn
+
+    def get(self, namespace, key):
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, _dumps(value), now + ttl if ttl else None),
+            )
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,))
+                conn.execute(
+                    "DELETE FROM cache_invalidations WHERE created_at < ?", (now - INVALIDATION_RETENTION,)
+                )
+
+    def invalidate(self, namespace, keys):
+        """Delete keys (None for the whole namespace) and log them for other workers."""
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            for key in keys:
+                if key is None:
+                    conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (namespace,))
+                else:
+                    conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+                conn.execute(
+                    "INSERT INTO cache_invalidations (namespace, key, created_at) VALUES (?, ?, ?)",
+                    (namespace, key, now),
+                )
+
+    def invalidations_since(self, position):
+        """Return (new position, [(namespace, key)]) logged after position (None: start now)."""
+        conn = self._connect()
+        if position is None:
+            row = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM cache_invalidations").fetchone()
+            return row[0], []
+        rows = conn.execute(
+            "SELECT seq, namespace, key FROM cache_invalidations WHERE seq > ? ORDER BY seq", (position,)
+        ).fetchall()
+        if not rows:
+            return position, []
+        return rows[-1][0], [(namespace, key) for _, namespace, key in rows]
+
+
+class RedisBackend:
+    """Entries as Redis strings with expiry; the invalidation log is a capped stream."""
+
+    STREAM_LENGTH = 10000
+
+    def __init__(self, url, prefix="nutrino"):
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.prefix = prefix
+        self.stream = f"{prefix}:invalidations"
+
+    def _key(self, namespace, key):
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def get(self, namespace, key):
+        raw = self.client.get(self._key(namespace, key))
+        return None if raw is None else json.loads(raw)
+
+    def set(self, namespace, key, value, ttl):
+        self.client.set(self._key(namespace, key), _dumps(value), ex=int(ttl) if ttl else None)
+
+    def invalidate(self, namespace, keys):
+        pipe = self.client.pipeline()
+        for key in keys:
+            if key is None:
+                for name in self.client.scan_iter(match=f"{self.prefix}:{namespace}:*", count=500):
+                    pipe.delete(name)
+            else:
+                pipe.delete(self._key(namespace, key))
+            pipe.xadd(
+                self.stream, {"namespace": namespace, "key": "" if key is None else key},
+                maxlen=self.STREAM_LENGTH, approximate=True,
+            )
+        pipe.execute()
+
+    def invalidations_since(self, position):
+        if position is None:
+            last = self.client.xrevrange(self.stream, count=1)
+            return (last[0][0] if last else b"0-0"), []
+        entries = self.client.xread({self.stream: position}, count=1000) or []
+        changes = []
+        for _, messages in entries:
+            for message_id, fields in messages:
+                position = message_id
+                key = fields.get(b"key", b"").decode("utf-8")
+                changes.append((fields.get(b"namespace", b"").decode("utf-8"), key or None))
+        return position, changes
+
+
+def _sqlite_backend(path=None):
+    # Other local users must neither read cached entries nor plant their own
+    try:
+        if path is None:
+            path = os.path.join(private_dir(), "shared_cache.db")
+        else:
+            private_dir(os.path.dirname(os.path.abspath(path)))
+    except OSError as e:
+        print(f"Shared cache disabled, caching per process: {e}")
+        return None
+    return SQLiteBackend(path)
+
+
+def create_backend(url=SHARED_CACHE_URL):
+    """Build the configured shared backend, or None for process-local caching."""
+    if url is None:
+        return _sqlite_backend()
+    if not url or url.lower() == "none":
+        return None
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            return RedisBackend(url)
+        except ImportError:
+            print("SHARED_CACHE_URL is a Redis URL but the redis package is not installed; caching per process")
+            return None
+    if url.startswith("sqlite:///"):
+        url = url[len("sqlite:///"):]
+    return _sqlite_backend(url)
+
+
+class TieredCache:
+    """
+    A TTLCache in front of a shared backend, for one namespace of keys.
+
+    Backend errors are logged and treated as misses, so a broken shared
+    tier degrades to per-process caching.
+    """
+
+    def __init__(self, namespace, local, backend=None):
+        self.namespace = namespace
+        self.local = local
+        self.backend = backend
+        self._position = None
+        self._synced_at = 0
+        self._sync_lock = threading.Lock()
+
+    def _sync(self):
+        now = time.monotonic()
+        if self.backend is None or now - self._synced_at < SYNC_INTERVAL:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._synced_at = now
+            self._position, changes = self.backend.invalidations_since(self._position)
+            for namespace, key in changes:
+                if namespace != self.namespace:
+                    continue
+                if key is None:
+                    self.local.clear()
+                else:
+                    self.local.delete(key)
+        except Exception as e:
+            print(f"Shared cache sync error: {e}")
+        finally:
+            self._sync_lock.release()
+
+    def get(self, key, default=None):
+        self._sync()
+        value = self.local.get(key)
+        if value is not None or self.backend is None:
+            return default if value is None else value
+        try:
+            value = self.backend.get(self.namespace, key)
+        except Exception as e:
+            print(f"Shared cache read error: {e}")
+            value = None
+        metrics.record_cache(f"{self.namespace}_shared", value is not None)
+        if value is None:
+            return default
+        self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.backend is not None:
+            try:
+                self.backend.set(self.namespace, key, value, self.local.ttl)
+            except Exception as e:
+                print(f"Shared cache write error: {e}")
+
+    def invalidate(self, *keys):
+        """Drop keys everywhere; other workers drop their copies on their next sync."""
+        for key in keys:
+            self.local.delete(key)
+        self._publish(keys)
+
+    def clear(self):
+        """Drop every key in this namespace, in all workers."""
+        self.local.clear()
+        self._publish([None])
+
+    def _publish(self, keys):
+        if self.backend is None or not keys:
+            return
+        try:
+            self.backend.invalidate(self.namespace, list(keys))
+        except Exception as e:
+            print(f"Shared cache invalidation error: {e}")
+
+    def stats(self):
+        return self.local.stats()
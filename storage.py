@@ -0,0 +1,548 @@
+"""
+Storage backends.
+
+The app talks to a Storage object instead of a database client. Two
+backends implement it: FirestoreStorage (the hosted deployment) and
+SQLiteStorage, a local engine for on-prem, staging and offline use that
+reads the food catalog from neutrino.db. STORAGE_BACKEND selects one ("firestore" by default).
+"""
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import uuid
+
+from cache import TTLCache
+from catalog import CATALOG_DB, decode_text, matches_query, query_keywords, search_keywords
+from daylog import (
+    MIGRATED_FLAG, add_meals, add_recipe_meal, apply_meal_edits, day_ref, day_totals, migrate_user, stream_range
+)
+import counters
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "firestore")
+# User data stays out of the tracked catalog file
+SQLITE_PATH = os.environ.get(
+    "SQLITE_PATH", os.path.join(os.path.dirname(CATALOG_DB), "instance", "nutrino.db")
+)
+MAX_BATCH_WRITES = 500  # Firestore limit on writes per commit or transaction
+KEYWORD_CANDIDATES = 4  # docs fetched per wanted result, since keywords are truncated
+
+# Storage methods that modify data; everything else only reads (prepare_user
+# counts as a read since it only writes once per user, when migrating)
+WRITE_METHODS = frozenset({
+    "create_user", "update_user", "add_meals", "add_meal", "edit_meals", "add_recipe_meal"
+})
+
+
+class Storage:
+    """
+    Interface for users, per-day meals, the food catalog and shared recipes.
+
+    Days are returned as {"date", "meals", "totals"} dicts where each meal
+    carries its meal_id and per-serving carb/protein/kcal.
+    """
+
+    # Users
+    def get_user(self, user_id):
+        """Return the user's fields, or None if there is no such user."""
+        raise NotImplementedError
+
+    def create_user(self, user_id, data):
+        raise NotImplementedError
+
+    def update_user(self, user_id, fields):
+        raise NotImplementedError
+
+    def prepare_user(self, user_id, user_data):
+        """
+        Bring a user's stored meals up to date; returns True if anything was rewritten.
+
+        user_data is updated to match, so it can be cached as is afterwards.
+        """
+        return False
+
+    # Meals
+    def get_day(self, user_id, date):
+        """Return the day dict for date, or None if nothing was logged."""
+        raise NotImplementedError
+
+    def iter_days(self, user_id, start, end):
+        """Yield the day dicts between start and end (inclusive)."""
+        raise NotImplementedError
+
+    def add_meals(self, user_id, date, meals):
+        """Append meals to a day atomically and return their meal ids."""
+        raise NotImplementedError
+
+    def add_meal(self, user_id, date, meal):
+        return self.add_meals(user_id, date, [meal])[0]
+
+    def edit_meals(self, user_id, edits):
+        """
+        Apply {date: [(meal_id, serving)]} edits, where a serving of None
+        deletes the meal. Returns the edits that matched a stored meal.
+        """
+        raise NotImplementedError
+
+    # Food catalog
+    def find_food(self, food_name):
+        """Return the food_data fields for an exact name, or None."""
+        raise NotImplementedError
+
+    def search_foods(self, query, limit=5):
+        """Return up to limit food names matching an autocomplete query."""
+        raise NotImplementedError
+
+    # Recipes
+    def get_recipe(self, recipe_id):
+        raise NotImplementedError
+
+    def search_recipes(self, query, limit=5):
+        raise NotImplementedError
+
+    def recipe_names(self):
+        raise NotImplementedError
+
+    def recipe_summaries(self):
+        """Name, calories, carbs and protein of every shared recipe."""
+        raise NotImplementedError
+
+    def recipe_uses(self, recipe_id):
+        """Exact number of times a shared recipe has been saved."""
+        raise NotImplementedError
+
+    def recipe_stats(self):
+        """
+        recipe_id, name, macros, meal_time, created_at and exact times_used
+        of every shared recipe.
+        """
+        raise NotImplementedError
+
+    def add_recipe_meal(self, user_id, date, meal, recipe_id, recipe):
+        """
+        Add a recipe meal and create the shared recipe or count another use
+        of it, in one commit. Returns True if the recipe was new.
+        """
+        raise NotImplementedError
+
+
+class FirestoreStorage(Storage):
+    """Storage on Cloud Firestore, with meals in per-day documents."""
+
+    def __init__(self, db=None):
+        self._db = db
+        self._init_lock = threading.Lock()
+        # recipe_id -> True once the shared recipe doc is known to exist
+        self.known_recipes = TTLCache(max_entries=4096, ttl=24 * 3600)
+
+    @property
+    def db(self):
+        """The Firestore client, created on first use to keep cold starts fast."""
+        if self._db is None:
+            with self._init_lock:
+                if self._db is None:
+                    import firebase_admin
+                    from firebase_admin import credentials, firestore
+
+                    if not firebase_admin._apps:
+                        firebase_admin.initialize_app(credentials.Certificate("serviceAccountKey.json"))
+                    self._db = firestore.client()
+        return self._db
+
+    def _user_ref(self, user_id):
+        return self.db.collection("users").document(user_id)
+
+    def get_user(self, user_id):
+        snapshot = self._user_ref(user_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def create_user(self, user_id, data):
+        self._user_ref(user_id).set({**data, MIGRATED_FLAG: True})
+
+    def update_user(self, user_id, fields):
+        self._user_ref(user_id).update(fields)
+
+    def prepare_user(self, user_id, user_data):
+        if user_data.get(MIGRATED_FLAG):
+            return False
+        migrate_user(self.db, user_id)
+        user_data[MIGRATED_FLAG] = True
+        return True
+
+    def get_day(self, user_id, date):
+        snapshot = day_ref(self.db, user_id, date).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def iter_days(self, user_id, start, end):
+        return stream_range(self.db, user_id, start, end)
+
+    def add_meals(self, user_id, date, meals):
+        return add_meals(self.db, user_id, date, meals)
+
+    def edit_meals(self, user_id, edits):
+        return apply_meal_edits(self.db, user_id, edits)
+
+    def find_food(self, food_name):
+        docs = self.db.collection("food_data").where("food_name", "==", food_name).limit(1).get()
+        return docs[0].to_dict() if docs else None
+
+    def _keyword_search(self, collection, field, query, limit):
+        names = []
+        for keyword in query_keywords(query):
+            docs = self.db.collection(collection) \
+                       .where("search_keywords", "array_contains", keyword) \
+                       .select([field]) \
+                       .limit(limit * KEYWORD_CANDIDATES).stream()
+            for doc in docs:
+                name = doc.to_dict().get(field)
+                if name and name not in names and matches_query(name, query):
+                    names.append(name)
+            if len(names) >= limit:
+                break
+        return names[:limit]
+
+    def search_foods(self, query, limit=5):
+        return self._keyword_search("food_data", "food_name", query, limit)
+
+    def get_recipe(self, recipe_id):
+        snapshot = self.db.collection("recipes").document(recipe_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def search_recipes(self, query, limit=5):
+        return self._keyword_search("recipes", "name", query, limit)
+
+    def recipe_names(self):
+        return [doc.to_dict().get("name") for doc in self.db.collection("recipes").select(["name"]).stream()]
+
+    def recipe_summaries(self):
+        fields = ["name", "calories", "carbs", "protein"]
+        return [doc.to_dict() for doc in self.db.collection("recipes").select(fields).stream()]
+
+    def recipe_uses(self, recipe_id):
+        return counters.total(self.db.collection("recipes").document(recipe_id), "times_used")
+
+    def recipe_stats(self):
+        fields = ["name", "calories", "carbs", "protein", "meal_time", "created_at", "times_used"]
+        stats = []
+        shards = counters.totals_by_parent(self.db, "recipes", "times_used")
+        for doc in self.db.collection("recipes").select(fields).stream():
+            recipe = {**doc.to_dict(), "recipe_id": doc.id}
+            recipe["times_used"] = (recipe.get("times_used") or 0) + shards.get(doc.id, 0)
+            stats.append(recipe)
+        return stats
+
+    def add_recipe_meal(self, user_id, date, meal, recipe_id, recipe):
+        recipe_ref = self.db.collection("recipes").document(recipe_id)
+        # Recipes known to exist are not read again; times_used lives in counter shards
+        new_recipe = None if self.known_recipes.get(recipe_id) else {
+            **recipe, "search_keywords": search_keywords(recipe.get("name", ""))
+        }
+        created = add_recipe_meal(self.db, user_id, date, meal, recipe_ref, new_recipe)
+        self.known_recipes.set(recipe_id, True)
+        return created
+
+
+USER_COLUMNS = ("password_hash", "weight", "height", "bmi", "rec_cal", "created_at", "updated_at")
+MEAL_COLUMNS = ("food_name", "food_code", "serving", "carb", "protein", "kcal")
+RECIPE_COLUMNS = ("name", "calories", "protein", "carbs", "created_by", "created_at")
+TEXT_FOOD_COLUMNS = ("food_code", "food_name", "primarysource", "servings_unit")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    username TEXT PRIMARY KEY,
+    password_hash TEXT NOT NULL,
+    weight REAL, height REAL, bmi REAL, rec_cal REAL,
+    created_at TEXT, updated_at TEXT,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS meals (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    meal_id TEXT NOT NULL UNIQUE,
+    username TEXT NOT NULL,
+    date TEXT NOT NULL,
+    food_name TEXT NOT NULL,
+    food_code TEXT,
+    serving REAL NOT NULL,
+    carb REAL,
+    protein REAL,
+    kcal REAL,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS meals_user_date ON meals (username, date);
+CREATE TABLE IF NOT EXISTS recipes (
+    recipe_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    calories REAL, protein REAL, carbs REAL,
+    created_by TEXT, created_at TEXT,
+    times_used INTEGER NOT NULL DEFAULT 0,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS recipes_name ON recipes (name COLLATE NOCASE);
+"""
+
+
+def _split(data, columns):
+    """Split a dict into known column values and a JSON blob of the rest."""
+    values = [data.get(column) for column in columns]
+    extra = {key: value for key, value in data.items() if key not in columns}
+    return values, json.dumps(extra)
+
+
+class SQLiteStorage(Storage):
+    """
+    Local storage on SQLite.
+
+    Uses WAL mode and one connection per thread. The food_data TEXT
+    catalog (from catalog_path, opened read-only, unless path has its own
+    food_data table) is copied once into a `foods` table with REAL nutrient
+    columns. The schema is set up on first use rather than at construction.
+    """
+
+    def __init__(self, path=SQLITE_PATH, catalog_path=CATALOG_DB):
+        self.path = path
+        self.catalog_path = catalog_path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, cached_statements=256, uri=True)
+            conn.text_factory = decode_text
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(SCHEMA)
+                    self._upgrade(conn)
+                    attached = self._ensure_foods(conn)
+                    conn.commit()
+                    if attached:
+                        conn.execute("DETACH DATABASE catalog")
+                    self._initialized = True
+        return conn
+
+    def _upgrade(self, conn):
+        # Databases created before meals referenced catalog foods
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(meals)")}
+        if "food_code" not in columns:
+            conn.execute("ALTER TABLE meals ADD COLUMN food_code TEXT")
+
+    def _ensure_foods(self, conn):
+        """Build the foods table if missing; returns True if the catalog was attached for it."""
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "foods" in tables:
+            return False
+        schema = "main"
+        if "food_data" not in tables:
+            if not os.path.exists(self.catalog_path):
+                return False
+            uri = pathlib.Path(os.path.abspath(self.catalog_path)).as_uri() + "?mode=ro"
+            conn.execute("ATTACH DATABASE ? AS catalog", (uri,))
+            schema = "catalog"
+        columns = [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(food_data)")]
+        numeric = [column for column in columns if column not in TEXT_FOOD_COLUMNS]
+        definitions = ", ".join(f'"{column}" REAL' for column in numeric)
+        conn.execute(
+            "CREATE TABLE foods (food_code TEXT PRIMARY KEY, food_name TEXT NOT NULL, "
+            f"primarysource TEXT, servings_unit TEXT, {definitions})"
+        )
+        casts = ", ".join(f"CAST(NULLIF(TRIM(\"{column}\"), '') AS REAL)" for column in numeric)
+        conn.execute(
+            f"INSERT INTO foods SELECT food_code, food_name, primarysource, servings_unit, {casts} FROM {schema}.food_data"
+        )
+        conn.execute("CREATE INDEX foods_name ON foods (food_name COLLATE NOCASE)")
+        return schema == "catalog"
+
+    # Users
+    def get_user(self, user_id):
+        row = self._conn().execute("SELECT * FROM accounts WHERE username = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        user = {key: row[key] for key in row.keys() if key != "extra"}
+        user.update(json.loads(row["extra"]))
+        return user
+
+    def create_user(self, user_id, data):
+        values, extra = _split({k: v for k, v in data.items() if k != "username"}, USER_COLUMNS)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                f"INSERT INTO accounts (username, {', '.join(USER_COLUMNS)}, extra) "
+                f"VALUES (?, {', '.join('?' * len(USER_COLUMNS))}, ?)",
+                (user_id, *values, extra),
+            )
+
+    def update_user(self, user_id, fields):
+        conn = self._conn()
+        with conn:
+            known = {key: value for key, value in fields.items() if key in USER_COLUMNS}
+            if known:
+                assignments = ", ".join(f"{key} = ?" for key in known)
+                conn.execute(
+                    f"UPDATE accounts SET {assignments} WHERE username = ?", (*known.values(), user_id)
+                )
+            extra = {key: value for key, value in fields.items() if key not in USER_COLUMNS}
+            if extra:
+                conn.execute(
+                    "UPDATE accounts SET extra = json_patch(extra, ?) WHERE username = ?",
+                    (json.dumps(extra), user_id),
+                )
+
+    # Meals
+    def _meal(self, row):
+        meal = {"meal_id": row["meal_id"], "date": row["date"]}
+        meal.update({column: row[column] for column in MEAL_COLUMNS if row[column] is not None})
+        meal.update(json.loads(row["extra"]))
+        return meal
+
+    def _day(self, date, meals):
+        return {"date": date, "meals": meals, "totals": day_totals(meals)}
+
+    def get_day(self, user_id, date):
+        rows = self._conn().execute(
+            "SELECT * FROM meals WHERE username = ? AND date = ? ORDER BY seq", (user_id, date)
+        ).fetchall()
+        return self._day(date, [self._meal(row) for row in rows]) if rows else None
+
+    def iter_days(self, user_id, start, end):
+        rows = self._conn().execute(
+            "SELECT * FROM meals WHERE username = ? AND date BETWEEN ? AND ? ORDER BY date, seq",
+            (user_id, start, end),
+        )
+        date, meals = None, []
+        for row in rows:
+            if row["date"] != date:
+                if meals:
+                    yield self._day(date, meals)
+                date, meals = row["date"], []
+            meals.append(self._meal(row))
+        if meals:
+            yield self._day(date, meals)
+
+    def add_meals(self, user_id, date, meals):
+        conn = self._conn()
+        with conn:
+            return self._insert_meals(conn, user_id, date, meals)
+
+    def _insert_meals(self, conn, user_id, date, meals):
+        ids = []
+        for meal in meals:
+            meal_id = meal.get("meal_id") or uuid.uuid4().hex[:20]
+            values, extra = _split(
+                {k: v for k, v in meal.items() if k not in ("meal_id", "date")}, MEAL_COLUMNS
+            )
+            # Leave unset columns out so they keep their defaults
+            columns = [(c, v) for c, v in zip(MEAL_COLUMNS, values) if v is not None]
+            conn.execute(
+                f"INSERT OR IGNORE INTO meals (meal_id, username, date, {', '.join(c for c, _ in columns)}, extra) "
+                f"VALUES (?, ?, ?, {', '.join('?' * len(columns))}, ?)",
+                (meal_id, user_id, date, *(v for _, v in columns), extra),
+            )
+            ids.append(meal_id)
+        return ids
+
+    def edit_meals(self, user_id, edits):
+        conn = self._conn()
+        applied = []
+        with conn:
+            for date in sorted(edits):
+                for meal_id, serving in edits[date]:
+                    if serving is None:
+                        cursor = conn.execute(
+                            "DELETE FROM meals WHERE meal_id = ? AND username = ? AND date = ?",
+                            (meal_id, user_id, date),
+                        )
+                    else:
+                        cursor = conn.execute(
+                            "UPDATE meals SET serving = ? WHERE meal_id = ? AND username = ? AND date = ?",
+                            (serving, meal_id, user_id, date),
+                        )
+                    if cursor.rowcount:
+                        applied.append({"date": date, "meal_id": meal_id, "serving": serving})
+        return applied
+
+    # Food catalog
+    def find_food(self, food_name):
+        row = self._conn().execute(
+            "SELECT * FROM foods WHERE food_name = ? COLLATE NOCASE LIMIT 1", (food_name,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def _name_search(self, table, column, query, limit):
+        pattern = query.lower().replace("%", "").replace("_", "")
+        rows = self._conn().execute(
+            f"SELECT {column} FROM {table} WHERE lower({column}) LIKE ? OR lower({column}) LIKE ? LIMIT ?",
+            (f"{pattern}%", f"% {pattern}%", limit),
+        )
+        return [row[0] for row in rows]
+
+    def search_foods(self, query, limit=5):
+        return self._name_search("foods", "food_name", query, limit)
+
+    # Recipes
+    def get_recipe(self, recipe_id):
+        row = self._conn().execute("SELECT * FROM recipes WHERE recipe_id = ?", (recipe_id,)).fetchone()
+        if row is None:
+            return None
+        recipe = {key: row[key] for key in row.keys() if key != "extra"}
+        recipe.update(json.loads(row["extra"]))
+        return recipe
+
+    def search_recipes(self, query, limit=5):
+        return self._name_search("recipes", "name", query, limit)
+
+    def recipe_names(self):
+        return [row[0] for row in self._conn().execute("SELECT name FROM recipes")]
+
+    def recipe_summaries(self):
+        rows = self._conn().execute("SELECT name, calories, carbs, protein FROM recipes")
+        return [dict(row) for row in rows]
+
+    def recipe_uses(self, recipe_id):
+        row = self._conn().execute("SELECT times_used FROM recipes WHERE recipe_id = ?", (recipe_id,)).fetchone()
+        return row[0] if row else 0
+
+    def recipe_stats(self):
+        rows = self._conn().execute(
+            "SELECT recipe_id, name, calories, carbs, protein, created_at, times_used, extra FROM recipes"
+        )
+        stats = []
+        for row in rows:
+            recipe = {key: row[key] for key in row.keys() if key != "extra"}
+            recipe["meal_time"] = json.loads(row["extra"]).get("meal_time")
+            stats.append(recipe)
+        return stats
+
+    def add_recipe_meal(self, user_id, date, meal, recipe_id, recipe):
+        values, extra = _split(recipe, RECIPE_COLUMNS)
+        conn = self._conn()
+        with conn:
+            self._insert_meals(conn, user_id, date, [meal])
+            cursor = conn.execute(
+                "UPDATE recipes SET times_used = times_used + 1 WHERE recipe_id = ?", (recipe_id,)
+            )
+            if cursor.rowcount:
+                return False
+            conn.execute(
+                f"INSERT INTO recipes (recipe_id, {', '.join(RECIPE_COLUMNS)}, times_used, extra) "
+                f"VALUES (?, {', '.join('?' * len(RECIPE_COLUMNS))}, 1, ?)",
+                (recipe_id, *values, extra),
+            )
+        return True
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    """Build the configured storage backend."""
+    if backend == "sqlite":
+        return SQLiteStorage()
+    if backend == "firestore":
+        return FirestoreStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
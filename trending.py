@@ -0,0 +1,183 @@
+"""
+Trending recipes, kept in each worker so pages can show them without reads.
+
+A recipe's trend score is its saves weighted by exp(DECAY * (saved_at -
+epoch)), so a save from HALF_LIFE ago counts half as much as one now
+("forward decay"). Scores only change when a recipe is saved, so each
+board's top CAPACITY recipes can be kept exactly with a min-heap that is
+updated per save. There is one board per meal time in MEAL_TIMES plus one
+for all; any other meal time is counted on the all board only, so the
+number of boards stays fixed.
+
+save_recipe feeds saves in as they happen. Every RECONCILE_INTERVAL the
+boards are rebuilt from storage, which picks up saves made through other
+workers; stored counts carry no per-save times, so they are weighted by
+the recipe's created_at.
+"""
+import heapq
+import math
+import threading
+import time
+from datetime import datetime as dt
+
+HALF_LIFE = 7 * 24 * 3600  # seconds
+DECAY = math.log(2) / HALF_LIFE
+CAPACITY = 100  # recipes ranked per board
+RECONCILE_INTERVAL = 600  # seconds (10 minutes)
+ALL = "all"
+MEAL_TIMES = frozenset({"breakfast", "lunch", "dinner", "meal"})
+
+
+class TopK:
+    """Min-heap of the `capacity` highest scores; replaced entries are dropped lazily."""
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self._heap = []    # (score, key), possibly stale
+        self._scores = {}  # key -> current score, members only
+
+    def _drop_stale(self):
+        heap = self._heap
+        while heap and self._scores.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def offer(self, key, score):
+        """Record a key's new (higher) score; returns True if the ranking changed."""
+        if key in self._scores or len(self._scores) < self.capacity:
+            self._scores[key] = score
+            heapq.heappush(self._heap, (score, key))
+        else:
+            self._drop_stale()
+            if score <= self._heap[0][0]:
+                return False
+            _, evicted = heapq.heapreplace(self._heap, (score, key))
+            del self._scores[evicted]
+            self._scores[key] = score
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(score, key) for key, score in self._scores.items()]
+            heapq.heapify(self._heap)
+        return True
+
+    def ranked(self):
+        return sorted(self._scores, key=self._scores.get, reverse=True)
+
+
+def board_for(meal_time):
+    """The board a meal time is ranked on: itself if known, else ALL."""
+    if isinstance(meal_time, str) and meal_time.lower() in MEAL_TIMES:
+        return meal_time.lower()
+    return ALL
+
+
+def _timestamp(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return dt.fromisoformat(str(value)).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class TrendingRecipes:
+    """Per-worker top recipes by decayed popularity, overall and per meal time."""
+
+    def __init__(self, loader=None, capacity=CAPACITY):
+        self.loader = loader
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._reset(time.time())
+        self._reconciled_at = 0
+        self._reconciling = False
+        self._recent = []  # saves recorded while a reconcile runs
+
+    def _reset(self, epoch):
+        self._epoch = epoch
+        self._recipes = {}  # recipe_id -> name and macros
+        self._scores = {}   # board -> {recipe_id: score}
+        self._boards = {}   # board -> TopK
+        self._ranked = {}   # board -> cached ranking
+
+    def _weight(self, at):
+        return math.exp(DECAY * (at - self._epoch))
+
+    def _add(self, recipe_id, recipe, meal_time, count, at):
+        self._recipes[recipe_id] = {
+            "recipe_id": recipe_id,
+            "name": recipe.get("name") or recipe_id,
+            "calories": float(recipe.get("calories") or 0),
+            "protein": float(recipe.get("protein") or 0),
+            "carbs": float(recipe.get("carbs") or 0),
+        }
+        weight = count * self._weight(at)
+        for board in {ALL, board_for(meal_time)}:
+            scores = self._scores.setdefault(board, {})
+            scores[recipe_id] = scores.get(recipe_id, 0.0) + weight
+            top = self._boards.setdefault(board, TopK(self.capacity))
+            if top.offer(recipe_id, scores[recipe_id]):
+                self._ranked.pop(board, None)
+
+    def record(self, recipe_id, recipe, meal_time=None, at=None):
+        """Count one save of a recipe."""
+        at = time.time() if at is None else at
+        with self._lock:
+            self._add(recipe_id, recipe, meal_time, 1, at)
+            if self._reconciling:
+                self._recent.append((recipe_id, recipe, meal_time, at))
+
+    def reconcile(self):
+        """Rebuild every board from the stored recipe counts."""
+        started = time.time()
+        with self._lock:
+            self._recent = []
+        try:
+            stats = self.loader()
+        except Exception as e:
+            print(f"Error loading recipe stats for trending: {e}")
+            return
+        with self._lock:
+            self._reset(started)
+            for recipe in stats:
+                uses = recipe.get("times_used") or 0
+                if uses <= 0:
+                    continue
+                created = _timestamp(recipe.get("created_at")) or started
+                self._add(recipe["recipe_id"], recipe, recipe.get("meal_time"), uses, min(created, started))
+            # Saves that raced the storage read are counted again rather than lost
+            for recipe_id, recipe, meal_time, at in self._recent:
+                self._add(recipe_id, recipe, meal_time, 1, at)
+            self._recent = []
+
+    def _reconcile_in_background(self):
+        try:
+            self.reconcile()
+        finally:
+            with self._lock:
+                self._reconciled_at = time.time()
+                self._reconciling = False
+
+    def _maybe_reconcile(self):
+        if self.loader is None or time.time() - self._reconciled_at < RECONCILE_INTERVAL:
+            return
+        with self._lock:
+            if self._reconciling:
+                return
+            self._reconciling = True
+        threading.Thread(target=self._reconcile_in_background, daemon=True).start()
+
+    def top(self, meal_time=None, limit=5, max_kcal=None):
+        """Most popular recipes for a meal time (or overall), optionally under max_kcal."""
+        self._maybe_reconcile()
+        board = board_for(meal_time)
+        with self._lock:
+            ranked = self._ranked.get(board)
+            if ranked is None:
+                top = self._boards.get(board)
+                ranked = self._ranked[board] = [self._recipes[key] for key in top.ranked()] if top else []
+        results = []
+        for recipe in ranked:
+            if max_kcal is not None and recipe["calories"] > max_kcal:
+                continue
+            results.append(dict(recipe))
+            if len(results) == limit:
+                break
+        return results